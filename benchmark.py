@@ -0,0 +1,331 @@
+"""
+    Benchmarks of DeliciousAPI against a local stand-in for Delicious.com
+    and synthetic data; no requests are sent to Delicious.com.
+
+    Usage: python benchmark.py [benchmark ...]
+
+    Without arguments, all benchmarks are run. Available benchmarks:
+
+    connections
+        Queries per second with a new connection per query versus pooled
+        keep-alive connections.
+
+    parsing
+        CPU time per result page for extracting records and next page link
+        with two BeautifulSoup parses (as before) versus one parse, using
+        the fixture pages of check_parsers.py.
+
+    records
+        Memory of a synthetic corpus of 1M URL bookmarks held as plain
+        tuples versus DeliciousURLBookmark records.
+
+    corpus
+        Queries on a DeliciousCorpus of 1.2M synthetic user bookmarks
+        versus Python loops over the bookmark tuples (requires numpy).
+
+    posts
+        Memory of retrieving a full collection of 50,000 bookmarks from the
+        official API (/v1/posts/all) with get_user(), parsed with
+        BeautifulSoup (as before) versus streamed with iterparse, and of
+        backup_user() for 50,000 and 200,000 bookmarks.
+
+"""
+import BaseHTTPServer
+import datetime
+import gc
+import multiprocessing
+import random
+import resource
+import SocketServer
+import sys
+import tempfile
+import threading
+import time
+
+from BeautifulSoup import BeautifulSoup
+
+import check_parsers
+import deliciousapi
+
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Answers GET requests with the pages of its server, over HTTP/1.1 keep-alive."""
+
+    protocol_version = "HTTP/1.1"
+    # write headers and body of a response at once, which keeps small
+    # responses from stalling on delayed ACKs
+    wbufsize = -1
+
+    def do_GET(self):
+        body = self.server.pages.get(self.path)
+        if body is None:
+            self.send_response(404)
+            body = ""
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Local HTTP server standing in for Delicious.com, run in a background thread."""
+
+    daemon_threads = True
+
+    def __init__(self, pages):
+        """
+        @param pages: Maps request paths to response bodies.
+        @type pages: dict
+
+        """
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0), StandInHandler)
+        self.pages = pages
+        self.host = "127.0.0.1:%d" % self.server_address[1]
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+
+def benchmark_connections(queries=2000):
+    server = StandInServer({"/v2/json/urlinfo/abc": '[{"total_posts": 1}]'})
+    for pool_size, label in ((0, "new connection per query"), (2, "keep-alive pool")):
+        delicious = deliciousapi.DeliciousAPI(pool_size=pool_size)
+        start = time.time()
+        for i in range(queries):
+            delicious._query("/v2/json/urlinfo/abc", host=server.host)
+        elapsed = time.time() - start
+        delicious.close()
+        print "%-28s %7.0f queries/sec" % (label, queries / elapsed)
+    server.shutdown()
+
+
+def benchmark_parsing(repeat=20):
+    beautifulsoup = deliciousapi.DeliciousAPI(parser="beautifulsoup")
+    htmlparser = deliciousapi.DeliciousAPI(parser="htmlparser")
+    pages = [
+        ("url", "URL history page (50 bookmarks)", check_parsers.url_history_page(2)),
+        ("user", "user page (100 bookmarks)", check_parsers.user_page(2)),
+    ]
+    for kind, label, data in pages:
+        if kind == "url":
+            extract = beautifulsoup._extract_bookmarks_from_url_history
+        else:
+            extract = beautifulsoup._extract_bookmarks_from_user_history
+        def two_parses():
+            extract(data)
+            beautifulsoup._extract_next_path(BeautifulSoup(data))
+        print label
+        for name, parse in (("two BeautifulSoup parses", two_parses),
+                            ("one BeautifulSoup parse", lambda: beautifulsoup._parse_page(data, kind)),
+                            ("one HTMLParser pass", lambda: htmlparser._parse_page(data, kind))):
+            start = time.clock()
+            for i in range(repeat):
+                parse()
+            print "    %-28s %6.1f ms/page" % (name, 1000 * (time.clock() - start) / repeat)
+
+
+def _measure_memory(build, queue):
+    # runs in a child process, so that each measurement starts afresh
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    result = build()
+    elapsed = time.time() - start
+    gc.collect()
+    if not isinstance(result, (int, long)):
+        result = len(result)
+    queue.put(((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before) / 1024.0, elapsed, result))
+
+
+def measure_memory(build):
+    """Returns (peak memory growth in MB, seconds, size) of build() run in a child process.
+
+    The size is the number returned by build(), or the length of its result.
+
+    """
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_measure_memory, args=(build, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def synthetic_url_bookmarks(record, count):
+    """Returns count bookmarks created with record(user, tags, comment, timestamp).
+
+    Each bookmark has 3 tags out of a vocabulary of 5000 and a creation day
+    out of 1000. Tag strings and timestamps are new objects for every
+    bookmark, as they are when parsed from Delicious.com.
+
+    """
+    rng = random.Random(1)
+    vocabulary = [u"tag%d" % i for i in range(5000)]
+    days = [datetime.date(2009, 1, 1) + datetime.timedelta(days=i) for i in range(1000)]
+    bookmarks = []
+    for i in range(count):
+        tags = [(rng.choice(vocabulary) + u" ")[:-1] for j in range(3)]
+        day = rng.choice(days)
+        bookmarks.append(record(u"user%d" % (i % 1000), tags, u"", datetime.datetime(day.year, day.month, day.day)))
+    return bookmarks
+
+
+def _plain_tuples(count=1000000):
+    return synthetic_url_bookmarks(lambda *fields: fields, count)
+
+
+def _records(count=1000000):
+    return synthetic_url_bookmarks(deliciousapi.DeliciousURLBookmark, count)
+
+
+def benchmark_records():
+    for label, build in (("plain tuples", _plain_tuples), ("DeliciousURLBookmark", _records)):
+        megabytes, elapsed, count = measure_memory(build)
+        print "%-24s %d bookmarks: %5.0f MB, built in %.1fs" % (label, count, megabytes, elapsed)
+
+
+def benchmark_corpus(num_users=2000, bookmarks_per_user=600):
+    if deliciousapi.numpy is None:
+        print "skipped: numpy is not installed"
+        return
+    rng = random.Random(2)
+    vocabulary = [u"tag%d" % i for i in range(2000)]
+    days = [datetime.datetime(2009, 1, 1) + datetime.timedelta(days=i) for i in range(700)]
+    users = []
+    for i in range(num_users):
+        bookmarks = [deliciousapi.DeliciousUserBookmark(u"http://example.com/%d" % rng.randrange(100000), rng.sample(vocabulary, 3), u"", u"", rng.choice(days))
+                     for j in range(bookmarks_per_user)]
+        users.append(deliciousapi.DeliciousUser(u"user%d" % i, bookmarks))
+    corpus = deliciousapi.DeliciousCorpus()
+    start = time.time()
+    for user in users:
+        corpus.add(user)
+    print "ingesting %d bookmarks: %.1fs" % (num_users * bookmarks_per_user, time.time() - start)
+
+    # bookmarks tagged "tag7" from June to August 2009: count per day,
+    # tag counts and number of users per tag
+    first, last, tag = datetime.datetime(2009, 6, 1), datetime.datetime(2009, 9, 1), u"tag7"
+    start = time.time()
+    rows = corpus.select(start=first, end=last, tag=tag)
+    by_day = corpus.count_by_day(rows)
+    tag_counts = corpus.tag_counts(rows)
+    users_per_tag = corpus.users_per_tag(rows)
+    vectorized = time.time() - start
+    start = time.time()
+    loop_by_day, loop_tag_counts, loop_users_per_tag = {}, {}, {}
+    for user in users:
+        for url, tags, title, comment, timestamp in user.bookmarks:
+            if first <= timestamp < last and tag in tags:
+                day = timestamp.date()
+                loop_by_day[day] = loop_by_day.get(day, 0) + 1
+                for t in tags:
+                    loop_tag_counts[t] = loop_tag_counts.get(t, 0) + 1
+                    loop_users_per_tag.setdefault(t, set()).add(user.username)
+    loop = time.time() - start
+    assert by_day == sorted(loop_by_day.items())
+    assert tag_counts == loop_tag_counts
+    assert users_per_tag == dict((t, len(names)) for t, names in loop_users_per_tag.iteritems())
+    print "date range + tag filter, %d rows, 3 aggregations:" % len(rows)
+    print "    %-20s %.3fs" % ("DeliciousCorpus", vectorized)
+    print "    %-20s %.3fs" % ("loop over tuples", loop)
+
+    start = time.time()
+    tag_counts = corpus.tag_counts()
+    vectorized = time.time() - start
+    start = time.time()
+    loop_tag_counts = {}
+    for user in users:
+        for bookmark in user.bookmarks:
+            for t in bookmark[1]:
+                loop_tag_counts[t] = loop_tag_counts.get(t, 0) + 1
+    loop = time.time() - start
+    assert tag_counts == loop_tag_counts
+    print "tag counts of all rows:"
+    print "    %-20s %.3fs" % ("DeliciousCorpus", vectorized)
+    print "    %-20s %.3fs" % ("loop over tuples", loop)
+
+
+class StandInAPI(deliciousapi.DeliciousAPI):
+    """DeliciousAPI sending all queries to a stand-in server over plain HTTP."""
+
+    def __init__(self, host, **kwargs):
+        deliciousapi.DeliciousAPI.__init__(self, **kwargs)
+        self.stand_in_host = host
+
+    def _query(self, path, host="delicious.com", user=None, password=None, use_ssl=False, stream=False):
+        return deliciousapi.DeliciousAPI._query(self, path, self.stand_in_host, user, password, False, stream)
+
+    def get_user_with_beautifulsoup(self, username, password):
+        # the authenticated path of get_user() before /v1/posts/all was
+        # streamed
+        user = deliciousapi.DeliciousUser(username)
+        data = self._query("/v1/posts/all", host="api.del.icio.us", use_ssl=True, user=username, password=password)
+        bookmarks = []
+        for element in BeautifulSoup(data).findAll("post"):
+            tags = []
+            if element["tag"]:
+                tags = element["tag"].split()
+            timestamp = datetime.datetime.strptime(element["time"], "%Y-%m-%dT%H:%M:%SZ")
+            bookmarks.append(deliciousapi.DeliciousUserBookmark(element["href"], tags, element["description"] or u"", element["extended"] or u"", timestamp))
+        user.bookmarks = bookmarks
+        return user
+
+
+def posts_all_document(count):
+    """Returns a /v1/posts/all document with count posts."""
+    rng = random.Random(3)
+    out = ['<?xml version="1.0" encoding="UTF-8"?>\n<posts user="bob" update="2010-02-01T10:00:00Z" tag="" total="%d">' % count]
+    for i in range(count):
+        tags = " ".join("tag%d" % rng.randrange(5000) for j in range(3))
+        out.append('<post href="http://example.com/%d/page?a=1&amp;b=%d" hash="%032x" description="Example page %d" '
+                   'tag="%s" time="2009-%02d-%02dT12:00:00Z" extended="A comment on page %d" meta="%032x" />'
+                   % (i, i, i, i, tags, i % 12 + 1, i % 28 + 1, i, i))
+    out.append('</posts>')
+    return "\n".join(out)
+
+
+def benchmark_posts(count=50000):
+    server = StandInServer({"/v1/posts/all": posts_all_document(count)})
+    delicious = StandInAPI(server.host)
+    print "get_user() with password"
+    for label, get_user in (("BeautifulSoup", delicious.get_user_with_beautifulsoup),
+                            ("iterparse", delicious.get_user)):
+        megabytes, elapsed, bookmarks = measure_memory(lambda: get_user("bob", "secret").bookmarks)
+        print "    %-16s %6d bookmarks: %5.0f MB, retrieved in %.1fs" % (label, bookmarks, megabytes, elapsed)
+    print "backup_user()"
+    backup = tempfile.NamedTemporaryFile(suffix=".xml")
+    for size in (count, 4 * count):
+        server.pages["/v1/posts/all"] = posts_all_document(size)
+        megabytes, elapsed, bookmarks = measure_memory(lambda: delicious.backup_user("bob", "secret", backup.name))
+        print "    %-16s %6d bookmarks: %5.0f MB, retrieved in %.1fs" % ("iterparse", bookmarks, megabytes, elapsed)
+    backup.close()
+    server.shutdown()
+
+
+BENCHMARKS = [
+    ("connections", benchmark_connections),
+    ("parsing", benchmark_parsing),
+    ("records", benchmark_records),
+    ("corpus", benchmark_corpus),
+    ("posts", benchmark_posts),
+]
+
+
+def main(argv):
+    names = argv[1:] or [name for name, benchmark in BENCHMARKS]
+    benchmarks = dict(BENCHMARKS)
+    for name in names:
+        if name not in benchmarks:
+            print "unknown benchmark '%s'" % name
+            return 1
+    for name in names:
+        print "== %s" % name
+        benchmarks[name]()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
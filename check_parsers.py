@@ -0,0 +1,199 @@
+"""
+    Checks that the "htmlparser" and "beautifulsoup" parser backends of
+    DeliciousAPI extract the same bookmarks, URLs and next page links.
+
+    The pages checked are fixture pages modelled on the URL history, user
+    and tag pages of Delicious.com, plus randomly assembled bookmark markup
+    (use a different seed to check other pages). Pages which BeautifulSoup
+    itself cannot extract, e.g. a tag link without text, are skipped.
+
+    Usage: python check_parsers.py [number of random pages] [seed]
+
+"""
+import random
+import sys
+
+import deliciousapi
+
+
+def url_history_page(page, last=False):
+    """Returns a URL history page with 50 bookmarks."""
+    out = ['<html><body><ul id="bookmarklist">']
+    for i in range(50):
+        date = ""
+        if i % 3 == 0:
+            date = '<div class="dateGroup"><span> %d Jan 09 </span></div>' % (i % 28 + 1)
+        out.append('<li><div class="bookmark NOTHUMB">%s'
+                   '<div class="data"><h4><a class="taggedlink " href="http://example.com/">Example</a></h4>'
+                   '<div class="description"> note &amp; %d </div></div>'
+                   '<div class="meta"><a class="user user-tag" href="/user%d_%d">user%d_%d</a></div>'
+                   '<div class="tagdisplay"><a class="tag noplay" href="/tag/a">python</a>'
+                   '<a class="tag noplay" href="/tag/b">web&amp;dev</a></div></div></li>' % (date, i, page, i, page, i))
+    out.append('</ul>')
+    if not last:
+        out.append('<div id="pagination"><a class="pn prev" href="/url/abc?page=%d">prev</a>'
+                   '<a class="pn next" href="/url/abc?show=all&amp;page=%d">next</a></div>' % (page - 1, page + 1))
+    out.append('</body></html>')
+    return "\n".join(out)
+
+
+def user_page(page, last=False):
+    """Returns a user page (or tag page) with 100 bookmarks."""
+    out = ['<html><body><ul id="bookmarklist">']
+    for i in range(100):
+        date = description = ""
+        if i % 5 == 0:
+            date = '<div class="dateGroup"><span>%d Feb 10</span></div>' % (i % 28 + 1)
+        if i % 2:
+            description = '<div class="description">comment %d</div>' % i
+        out.append('<li><div class="bookmark">%s<div class="data"><h4>'
+                   '<a class="taggedlink " href="http://example.com/%d/%d?a=1&amp;b=2">Title %d &lt;x&gt;</a></h4>%s</div>'
+                   '<div class="tagdisplay"><a class="tag noplay">t%d</a></div></div></li>' % (date, page, i, i, description, i % 7))
+    out.append('</ul>')
+    if not last:
+        out.append('<div id="pagination"><a class="pn next" href="/bob?page=%d">next</a></div>' % (page + 1))
+    out.append('</body></html>')
+    return "\n".join(out)
+
+
+FIXTURES = [
+    ("url", url_history_page(1)),
+    ("url", url_history_page(2, last=True)),
+    ("user", user_page(1)),
+    ("user", user_page(2, last=True)),
+    ("tag", user_page(1)),
+    # the title link of a bookmark must not hide the user link of a URL
+    # history entry
+    ("url", '<div class="bookmark"><div class="data"><a class="taggedlink" href="/t">T</a></div>'
+            '<div class="meta"><a class="user user-tag" href="/bob">bob</a></div></div>'),
+    ("url", '<div class="bookmark"><div class="dateGroup"><span>\n 3 Mar 08\n</span><span>x</span></div>'
+            '<div class="data"><div class="description">a &amp; b &copy c &#8212; \xc3\xa9 <b>x</b></div>'
+            '<div class="description">second</div></div>'
+            '<div class="meta"><a class="user user-tag" href="/j%C3%A9">j</a><a class="user user-tag" href="/k">k</a></div>'
+            '<div class="tagdisplay"><a class="tag noplay">&lt;t&gt;</a><a class="tag  noplay">no</a></div>'
+            '<div class="bookmarkx"><div class="meta"><a class="user user-tag" href="/in">in</a></div></div></div>'
+            '<div class="bookmark"><div class="meta"><a class="user user-tag" href="">x</a></div><!-- c --></div>'),
+    ("user", '<div class="bookmark"><div class="data"><a class="taggedlink" href="/out">no</a></div></div>'
+             '<ul id="bookmarklist"><li><div class="bookmark"><div class="data">'
+             '<a class="taggedlink x" href="http://a/?q=&amp;&nbsp;&#39;&#200;&#x41;&amp">  T &amp; t  </a>'
+             '<a class="taggedlink" href="/2">2</a></div></div></li>'
+             '<li><div class="bookmark"><div class="data"><a class="taggedlink" href="/e"></a></div></div>'
+             '<div class="bookmark"><div class="dateGroup"><span>1 Jan 10</span></div>'
+             '<div class="data"><a class="taggedlink" href="/f"><!--x-->t</a></div></div></li></ul>'
+             '<ul id="bookmarklist"><div class="bookmark"></div></ul>'),
+    ("tag", '<a class="taggedlink" href="/1">x</a><a class="taggedlink" href="">y</a>'
+            '<a class="taggedlinks">z</a><a class="taggedlink">w</a>'
+            '<div id="pagination"><a class="pn" href="/p">p</a><a class="pn next" href="/n?a=1&amp;b=2">n</a></div>'
+            '<div id="pagination"><a class="pn next" href="/other">n</a></div>'),
+]
+
+
+class RandomPages(object):
+    """Assembles random result pages from the markup of Delicious.com."""
+
+    texts = ["T", " a &amp; b ", "x &lt;y&gt;", "caf\xc3\xa9", "&#8212;z", "<b>bold</b> t", "", "  sp  "]
+    hrefs = ["/bob", "/j%C3%A9", "http://example.com/?a=1&amp;b=2", "/", ""]
+
+    def __init__(self, seed):
+        self.random = random.Random(seed)
+
+    def link(self, css_class):
+        href = ' href="%s"' % self.random.choice(self.hrefs)
+        if css_class.startswith("tag "):
+            # tag links hold plain text on Delicious.com
+            text = self.random.choice([t for t in self.texts if t and "<" not in t])
+            if css_class == "tag noplay":
+                href = ""
+        else:
+            text = self.random.choice(self.texts)
+        return '<a class="%s"%s>%s</a>' % (css_class, href, text)
+
+    def links(self, choices):
+        return "".join(self.random.choice(choices)() for i in range(self.random.randint(0, 3)))
+
+    def part(self):
+        choice = self.random.randint(0, 7)
+        if choice == 0:
+            return '<div class="dateGroup"><span>%d Jan 09</span></div>' % self.random.randint(1, 28)
+        elif choice == 1:
+            return '<div class="data">%s</div>' % self.links([
+                lambda: self.link("taggedlink"),
+                lambda: self.link("taggedlink x"),
+                lambda: '<h4>%s</h4>' % self.link("taggedlink "),
+                lambda: '<div class="description">%s</div>' % self.random.choice(self.texts),
+                lambda: self.random.choice(self.texts)])
+        elif choice == 2:
+            return '<div class="meta">%s</div>' % self.links([
+                lambda: self.link("user user-tag"),
+                lambda: self.link("user"),
+                lambda: self.link("taggedlink"),
+                lambda: self.random.choice(self.texts)])
+        elif choice == 3:
+            return '<div class="tagdisplay">%s</div>' % self.links([
+                lambda: self.link("tag noplay"),
+                lambda: self.link("tag "),
+                lambda: self.random.choice(self.texts)])
+        elif choice == 4:
+            return self.random.choice(self.texts)
+        elif choice == 5:
+            return self.link(self.random.choice(["taggedlink", "user user-tag", "tag noplay"]))
+        return ""
+
+    def bookmark(self, nested=False):
+        inner = "".join(self.part() for i in range(self.random.randint(0, 5)))
+        if not nested and self.random.random() < 0.1:
+            inner += self.bookmark(nested=True)
+        return '<div class="%s">%s</div>' % (self.random.choice(["bookmark", "bookmark NOTHUMB"]), inner)
+
+    def page(self, kind):
+        items = "".join("<li>%s</li>" % self.bookmark() for i in range(self.random.randint(1, 6)))
+        if kind == "user" and self.random.random() < 0.8:
+            items = '<ul id="bookmarklist">%s</ul>' % items
+        pagination = self.random.choice(["", '<div id="pagination"><a class="pn next" href="/n?page=2">n</a></div>'])
+        return "<html><body>%s%s</body></html>" % (items, pagination)
+
+
+def compare(pages):
+    """Returns the number of checked and skipped pages and the mismatches."""
+    beautifulsoup = deliciousapi.DeliciousAPI(parser="beautifulsoup")
+    htmlparser = deliciousapi.DeliciousAPI(parser="htmlparser")
+    checked = skipped = 0
+    mismatches = []
+    for kind, data in pages:
+        try:
+            expected = beautifulsoup._parse_page(data, kind)
+        except (AttributeError, IndexError, TypeError):
+            skipped += 1
+            continue
+        checked += 1
+        actual = htmlparser._parse_page(data, kind)
+        if actual != expected:
+            mismatches.append((kind, data, expected, actual))
+    return checked, skipped, mismatches
+
+
+def main(argv):
+    count = 500
+    seed = 1
+    if len(argv) > 1:
+        count = int(argv[1])
+    if len(argv) > 2:
+        seed = int(argv[2])
+    random_pages = RandomPages(seed)
+    pages = list(FIXTURES)
+    for i in range(count):
+        for kind in ("url", "user", "tag"):
+            pages.append((kind, random_pages.page(kind)))
+    checked, skipped, mismatches = compare(pages)
+    for kind, data, expected, actual in mismatches[:5]:
+        print "MISMATCH (%s page)" % kind
+        print data
+        print "beautifulsoup: %r" % (expected,)
+        print "htmlparser:    %r" % (actual,)
+        print
+    print "%d pages checked, %d skipped, %d mismatches" % (checked, skipped, len(mismatches))
+    return len(mismatches) and 1 or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
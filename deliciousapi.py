@@ -52,14 +52,32 @@ __status__ = "Development"
 __url__ = "http://www.michael-noll.com/"
 __version__ = "1.6.7"
 
+from array import array
+import base64
+import calendar
 import cgi
+import collections
+import copy
+import cPickle
 import datetime
+import email.utils
 import hashlib
+import heapq
+import HTMLParser
+import httplib
+import math
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 from operator import itemgetter
+import os
+import Queue
+import random
 import re
 import socket
+import threading
 import time
-import urllib2
+import urlparse
+import xml.etree.cElementTree as ElementTree
 
 try:
     from BeautifulSoup import BeautifulSoup
@@ -83,14 +101,280 @@ except:
     print
     raise
 
+try:
+    import numpy
+except ImportError:
+    # numpy is optional and only required for DeliciousCorpus
+    numpy = None
+
+try:
+    import fcntl
+except ImportError:
+    # fcntl is not available on Windows and only required for sharing
+    # a DeliciousRateLimiter between processes
+    fcntl = None
+
+
+class _InternTable(object):
+    """Maps equal immutable values to one shared instance.
+
+    At most max_size values are remembered. They are kept in two
+    generations: a value looked up in the old generation moves to the young
+    one, and when the young generation is full, it becomes the old one and
+    the values which have not been used since are forgotten. This
+    approximates a least-recently-used policy with plain dict operations,
+    so no lock is needed; concurrent callers at worst get equal but
+    distinct instances.
+
+    """
+
+    def __init__(self, max_size):
+        assert max_size >= 2
+        self.max_size = max_size
+        self._young = {}
+        self._old = {}
+
+    def __len__(self):
+        return len(self._young) + len(self._old)
+
+    def intern(self, value):
+        """Returns the shared instance of value."""
+        young = self._young
+        shared = young.get(value)
+        if shared is None:
+            shared = self._old.get(value, value)
+            if len(young) >= self.max_size // 2:
+                self._old = young
+                young = self._young = {}
+            shared = young.setdefault(value, shared)
+        return shared
+
+    def clear(self):
+        """Forgets all values."""
+        self._young = {}
+        self._old = {}
+
+
+# tag strings and timestamps shared by all bookmark records; bounded so
+# that long-running processes (e.g. deliciousmonitor) do not keep every
+# tag and timestamp they have ever seen
+_interned_tags = _InternTable(100000)
+_interned_timestamps = _InternTable(10000)
+
+def _intern_tags(tags):
+    """Returns a list of the given tags, replacing equal tag strings by one shared instance."""
+    interned = []
+    for tag in tags:
+        if isinstance(tag, unicode):
+            # also turns BeautifulSoup's NavigableStrings (which reference
+            # the whole document tree) into plain Unicode strings
+            tag = unicode(tag)
+        interned.append(_interned_tags.intern(tag))
+    return interned
+
+def _intern_timestamp(timestamp):
+    """Returns one shared instance for equal timestamps.
+
+    Day-granularity timestamps of URL histories and user pages repeat
+    within a page. Second-granularity timestamps (JSON feeds, official API)
+    repeat when the same bookmark is retrieved more than once, e.g. as part
+    of both a user's collection and a URL's history in a DeliciousCorpus,
+    or by repeated refreshes of a monitored URL.
+
+    """
+    if timestamp is None:
+        return None
+    return _interned_timestamps.intern(timestamp)
+
+
+class DeliciousURLBookmark(collections.namedtuple('DeliciousURLBookmark', 'user tags comment timestamp')):
+    """A bookmark in the history of a URL.
+
+    This is a (user, tags, comment, timestamp) tuple whose fields can also
+    be accessed by name. Equal tag strings and timestamps are shared
+    between bookmarks to keep large collections compact in memory.
+
+    """
+    __slots__ = ()
+
+    def __new__(cls, user, tags, comment, timestamp):
+        return super(DeliciousURLBookmark, cls).__new__(cls, user, _intern_tags(tags), comment, _intern_timestamp(timestamp))
+
+
+class DeliciousUserBookmark(collections.namedtuple('DeliciousUserBookmark', 'url tags title comment timestamp')):
+    """A bookmark in the collection of a user.
+
+    This is a (url, tags, title, comment, timestamp) tuple whose fields can
+    also be accessed by name. Equal tag strings and timestamps are shared
+    between bookmarks to keep large collections compact in memory.
+
+    """
+    __slots__ = ()
+
+    def __new__(cls, url, tags, title, comment, timestamp):
+        return super(DeliciousUserBookmark, cls).__new__(cls, url, _intern_tags(tags), title, comment, _intern_timestamp(timestamp))
+
+
+class _BookmarkList(list):
+    """List of bookmark tuples which notes modifications other than appending.
+
+    Appending (append(), extend(), +=) keeps the fast built-in list methods;
+    the tag counts of the new bookmarks are added incrementally. All other
+    modifications set 'modified', so that the tag counts are recomputed.
+
+    """
+
+    modified = False
+
+    def __setitem__(self, index, value):
+        self.modified = True
+        list.__setitem__(self, index, value)
+
+    def __delitem__(self, index):
+        self.modified = True
+        list.__delitem__(self, index)
+
+    def __setslice__(self, i, j, sequence):
+        self.modified = True
+        list.__setslice__(self, i, j, sequence)
+
+    def __delslice__(self, i, j):
+        self.modified = True
+        list.__delslice__(self, i, j)
+
+    def insert(self, index, value):
+        self.modified = True
+        list.insert(self, index, value)
+
+    def pop(self, *args):
+        self.modified = True
+        return list.pop(self, *args)
+
+    def remove(self, value):
+        self.modified = True
+        list.remove(self, value)
+
+
+class _BookmarkCollection(object):
+    """Base class for objects holding a list of bookmark tuples.
+
+    Tag counts are maintained incrementally as bookmarks are added, so that
+    reading the aggregated tags does not require a walk over all bookmarks.
+    Bookmarks can be added with add_bookmark()/add_bookmarks() or appended
+    to the 'bookmarks' list directly. Other modifications of the list, or
+    assigning a new list to 'bookmarks' (which stores a copy of it), make
+    the tag counts be recomputed on the next access.
+
+    """
+
+    def __init__(self, bookmarks=None):
+        self.bookmarks = bookmarks or []
+
+    def get_bookmarks(self):
+        return self._bookmarks
+
+    def set_bookmarks(self, bookmarks):
+        self._bookmarks = _BookmarkList(bookmarks)
+        self._tag_counts = {}
+        self._tag_total = 0
+        self._counted = 0
+        self._sync_tags()
+    bookmarks = property(fget=get_bookmarks, fset=set_bookmarks, doc="The list of bookmark tuples")
+
+    def __setstate__(self, state):
+        # instances pickled by earlier versions hold a plain 'bookmarks'
+        # list and no tag counts
+        bookmarks = state.pop('bookmarks', None)
+        self.__dict__.update(state)
+        if bookmarks is not None or '_bookmarks' not in state:
+            self.set_bookmarks(bookmarks or [])
+
+    def add_bookmark(self, bookmark):
+        """Appends a bookmark tuple and updates the tag counts."""
+        self._sync_tags()
+        self._bookmarks.append(bookmark)
+        self._sync_tags()
+
+    def add_bookmarks(self, bookmarks, prepend=False):
+        """Adds bookmark tuples and updates the tag counts.
+
+        @param bookmarks: The bookmark tuples to add.
+        @type bookmarks: iterable
+
+        @param prepend: Optional, default: False.
+            Insert the bookmarks before the existing ones (e.g. for newer
+            bookmarks) instead of appending them.
+        @type prepend: bool
+
+        """
+        self._sync_tags()
+        if prepend:
+            bookmarks = list(bookmarks)
+            list.__setslice__(self._bookmarks, 0, 0, bookmarks)
+            self._count_tags(bookmarks)
+            self._counted += len(bookmarks)
+        else:
+            self._bookmarks.extend(bookmarks)
+            self._sync_tags()
+
+    def _count_tags(self, bookmarks):
+        tag_counts = self._tag_counts
+        for bookmark in bookmarks:
+            tags = bookmark[1]
+            self._tag_total += len(tags)
+            for tag in tags:
+                tag_counts[tag] = tag_counts.get(tag, 0) + 1
+
+    def _sync_tags(self):
+        """Brings the tag counts up to date with the bookmarks list."""
+        if self._bookmarks.modified or len(self._bookmarks) < self._counted:
+            # bookmarks have been replaced or removed, so we have to start over
+            self._bookmarks.modified = False
+            self._tag_counts = {}
+            self._tag_total = 0
+            self._counted = 0
+        if len(self._bookmarks) > self._counted:
+            self._count_tags(self._bookmarks[self._counted:])
+            self._counted = len(self._bookmarks)
+
+    def get_tags(self):
+        """Returns a dictionary mapping tags to their tag count.
+
+        For example, if the tag count of tag 'foo' is 23, then
+        23 bookmarks were annotated with 'foo'. A different way
+        to put it is that 23 users used the tag 'foo' when
+        bookmarking the URL.
+
+        @return: Dictionary mapping tags to their tag count.
+
+        """
+        return dict(self._get_tag_counts())
+    tags = property(fget=get_tags, doc="Returns a dictionary mapping tags to their tag count")
+
+    def most_common(self, k):
+        """Returns the k most frequently used tags.
+
+        @param k: Number of tags to return.
+        @type k: int
+
+        @return: List of up to k (tag, tag_count) tuples, most frequent tags first.
+
+        """
+        return heapq.nlargest(k, self._get_tag_counts().iteritems(), key=itemgetter(1))
+
+    def _get_tag_counts(self):
+        """Returns the up-to-date tag counts without copying them."""
+        self._sync_tags()
+        return self._tag_counts
+
 
-class DeliciousUser(object):
+class DeliciousUser(_BookmarkCollection):
     """This class wraps all available information about a user into one object.
 
     Variables:
         bookmarks:
             A list of (url, tags, title, comment, timestamp) tuples representing
-            a user's bookmark collection.
+            a user's bookmark collection (see DeliciousUserBookmark).
 
             url is a 'unicode'
             tags is a 'list' of 'unicode' ([] if no tags)
@@ -110,49 +394,27 @@ class DeliciousUser(object):
     def __init__(self, username, bookmarks=None):
         assert username
         self.username = username
-        self.bookmarks = bookmarks or []
+        _BookmarkCollection.__init__(self, bookmarks)
 
     def __str__(self):
-        total_tag_count = 0
-        total_tags = set()
-        for url, tags, title, comment, timestamp in self.bookmarks:
-            if tags:
-                total_tag_count += len(tags)
-            for tag in tags:
-                total_tags.add(tag)
+        tag_counts = self._get_tag_counts()
         return "[%s] %d bookmarks, %d tags (%d unique)" % \
-                    (self.username, len(self.bookmarks), total_tag_count, len(total_tags))
+                    (self.username, len(self.bookmarks), self._tag_total, len(tag_counts))
 
     def __repr__(self):
         return self.username
 
-    def get_tags(self):
-        """Returns a dictionary mapping tags to their tag count.
-
-        For example, if the tag count of tag 'foo' is 23, then
-        23 bookmarks were annotated with 'foo'. A different way
-        to put it is that 23 users used the tag 'foo' when
-        bookmarking the URL.
-
-        """
-        total_tags = {}
-        for url, tags, title, comment, timestamp in self.bookmarks:
-            for tag in tags:
-                total_tags[tag] = total_tags.get(tag, 0) + 1
-        return total_tags
-    tags = property(fget=get_tags, doc="Returns a dictionary mapping tags to their tag count")
-
 
-class DeliciousURL(object):
+class DeliciousURL(_BookmarkCollection):
     """This class wraps all available information about a web document into one object.
 
     Variables:
         bookmarks:
             A list of (user, tags, comment, timestamp) tuples, representing a
-            document's bookmark history. Generally, this variable is populated
-            via get_url(), so the number of bookmarks available in this variable
-            depends on the parameters of get_url(). See get_url() for more
-            information.
+            document's bookmark history (see DeliciousURLBookmark). Generally,
+            this variable is populated via get_url(), so the number of bookmarks
+            available in this variable depends on the parameters of get_url().
+            See get_url() for more information.
 
             user is a 'unicode'
             tags is a 'list' of 'unicode's ([] if no tags)
@@ -199,48 +461,1452 @@ class DeliciousURL(object):
         assert url
         self.url = url
         self.top_tags = top_tags or []
-        self.bookmarks = bookmarks or []
+        _BookmarkCollection.__init__(self, bookmarks)
         self.title = title
         self.total_bookmarks = total_bookmarks
 
     def __str__(self):
-        total_tag_count = 0
-        total_tags = set()
-        for user, tags, comment, timestamp in self.bookmarks:
-            if tags:
-                total_tag_count += len(tags)
-            for tag in tags:
-                total_tags.add(tag)
+        tag_counts = self._get_tag_counts()
         return "[%s] %d total bookmarks (= users), %d tags (%d unique), %d out of 10 max 'top' tags" % \
-                    (self.url, self.total_bookmarks, total_tag_count, \
-                    len(total_tags), len(self.top_tags))
+                    (self.url, self.total_bookmarks, self._tag_total, \
+                    len(tag_counts), len(self.top_tags))
 
     def __repr__(self):
         return self.url
 
-    def get_tags(self):
+    def get_hash(self):
+        m = hashlib.md5()
+        m.update(self.url)
+        return m.hexdigest()
+    hash = property(fget=get_hash, doc="Returns the MD5 hash of the URL of this document")
+
+
+class DeliciousCorpus(object):
+    """This class stores the bookmarks of many users and URLs in columnar form.
+
+    Bookmarks are ingested from DeliciousUser and DeliciousURL instances and
+    stored as one row per bookmark in compact integer arrays: user, URL and
+    tag strings are replaced by integer ids, timestamps are stored as
+    seconds since the epoch (UTC), and the tags of all rows are stored in
+    one array indexed by per-row offsets. Queries are evaluated with
+    vectorized NumPy operations instead of Python loops over tuples.
+
+    Note that a bookmark is stored twice if it is ingested both from its
+    user and from its URL.
+
+    The numpy module is required for this class.
+
+    Variables:
+        users:
+            List of user names, indexed by user id.
+
+        urls:
+            List of URLs, indexed by URL id.
+
+        tag_names:
+            List of tags, indexed by tag id.
+
+    """
+
+    # timestamp value of bookmarks without a creation time
+    MISSING_TIMESTAMP = -2**63
+
+    def __init__(self):
+        if numpy is None:
+            raise ImportError("DeliciousCorpus requires the numpy module (http://numpy.scipy.org/)")
+        self.users = []
+        self.urls = []
+        self.tag_names = []
+        self._user_ids = {}
+        self._url_ids = {}
+        self._tag_ids = {}
+        self._user_col = array('l')
+        self._url_col = array('l')
+        self._time_col = array('d')
+        self._tag_col = array('l')
+        self._tag_offsets = array('l', [0])
+        # NumPy arrays of the columns, built on demand
+        self._arrays = None
+
+    def __len__(self):
+        return len(self._user_col)
+
+    def __str__(self):
+        return "%d bookmarks of %d users, %d URLs and %d tags" % \
+                    (len(self), len(self.users), len(self.urls), len(self.tag_names))
+
+    def _get_id(self, ids, names, name):
+        try:
+            return ids[name]
+        except KeyError:
+            ids[name] = len(names)
+            names.append(name)
+            return ids[name]
+
+    def _add_row(self, user, url, tags, timestamp):
+        self._user_col.append(self._get_id(self._user_ids, self.users, user))
+        self._url_col.append(self._get_id(self._url_ids, self.urls, url))
+        if timestamp is None:
+            self._time_col.append(self.MISSING_TIMESTAMP)
+        else:
+            self._time_col.append(calendar.timegm(timestamp.timetuple()))
+        for tag in tags:
+            self._tag_col.append(self._get_id(self._tag_ids, self.tag_names, tag))
+        self._tag_offsets.append(len(self._tag_col))
+        self._arrays = None
+
+    def add_user(self, user):
+        """Adds all bookmarks of a DeliciousUser instance."""
+        for url, tags, title, comment, timestamp in user.bookmarks:
+            self._add_row(user.username, url, tags, timestamp)
+
+    def add_url(self, document):
+        """Adds all bookmarks of a DeliciousURL instance."""
+        for user, tags, comment, timestamp in document.bookmarks:
+            self._add_row(user, document.url, tags, timestamp)
+
+    def add(self, obj):
+        """Adds all bookmarks of a DeliciousUser or DeliciousURL instance."""
+        if isinstance(obj, DeliciousUser):
+            self.add_user(obj)
+        else:
+            self.add_url(obj)
+
+    def _get_arrays(self):
+        if self._arrays is None:
+            # copies the buffers of the columns instead of converting them
+            # item by item; the 'd' array holds integral seconds and
+            # converts exactly
+            def column(col):
+                return numpy.frombuffer(col, dtype=col.typecode).astype(numpy.int64)
+            self._arrays = {
+                'user': column(self._user_col),
+                'url': column(self._url_col),
+                'time': column(self._time_col),
+                'tag': column(self._tag_col),
+                'offsets': column(self._tag_offsets),
+            }
+            # maps each entry of the tag column to its row
+            counts = numpy.diff(self._arrays['offsets'])
+            self._arrays['tag_row'] = numpy.repeat(numpy.arange(len(counts)), counts)
+        return self._arrays
+
+    def select(self, start=None, end=None, tag=None, user=None, url=None):
+        """Returns the rows of all bookmarks matching the given criteria.
+
+        All criteria are optional and combined with AND.
+
+        @param start: Only bookmarks created at or after this time.
+        @type start: datetime.datetime
+
+        @param end: Only bookmarks created before this time.
+        @type end: datetime.datetime
+
+        @param tag: Only bookmarks annotated with this tag.
+        @type tag: unicode
+
+        @param user: Only bookmarks of this user.
+        @type user: unicode
+
+        @param url: Only bookmarks of this URL.
+        @type url: unicode
+
+        @return: NumPy array of row indices, which can be passed to the
+            other query methods.
+
+        """
+        arrays = self._get_arrays()
+        mask = numpy.ones(len(self), dtype=bool)
+        if start is not None:
+            mask &= arrays['time'] >= calendar.timegm(start.timetuple())
+        if end is not None:
+            mask &= (arrays['time'] < calendar.timegm(end.timetuple())) & (arrays['time'] != self.MISSING_TIMESTAMP)
+        if user is not None:
+            mask &= arrays['user'] == self._user_ids.get(user, -1)
+        if url is not None:
+            mask &= arrays['url'] == self._url_ids.get(url, -1)
+        if tag is not None:
+            tagged = numpy.zeros(len(self), dtype=bool)
+            tagged[arrays['tag_row'][arrays['tag'] == self._tag_ids.get(tag, -1)]] = True
+            mask &= tagged
+        return numpy.flatnonzero(mask)
+
+    def _tag_entries(self, rows):
+        """Returns a boolean mask over the tag column for the given rows."""
+        arrays = self._get_arrays()
+        if rows is None:
+            return numpy.ones(len(arrays['tag']), dtype=bool)
+        selected = numpy.zeros(len(self), dtype=bool)
+        selected[rows] = True
+        return selected[arrays['tag_row']]
+
+    def count_by_day(self, rows=None):
+        """Returns the number of bookmarks per creation day.
+
+        @param rows: Optional, default: None (all rows).
+            Restrict the query to these rows (see select()).
+        @type rows: NumPy array
+
+        @return: List of (datetime.date, count) tuples sorted by day.
+            Bookmarks without creation time are not counted.
+
+        """
+        times = self._get_arrays()['time']
+        if rows is not None:
+            times = times[rows]
+        times = times[times != self.MISSING_TIMESTAMP]
+        days, counts = numpy.unique(times // 86400, return_counts=True)
+        epoch = datetime.date(1970, 1, 1)
+        return [(epoch + datetime.timedelta(days=int(day)), int(count)) for day, count in zip(days, counts)]
+
+    def tag_counts(self, rows=None):
         """Returns a dictionary mapping tags to their tag count.
 
-        For example, if the tag count of tag 'foo' is 23, then
-        23 bookmarks were annotated with 'foo'. A different way
-        to put it is that 23 users used the tag 'foo' when
-        bookmarking the URL.
+        @param rows: Optional, default: None (all rows).
+            Restrict the query to these rows (see select()).
+        @type rows: NumPy array
 
-        @return: Dictionary mapping tags to their tag count.
+        """
+        tag_ids = self._get_arrays()['tag'][self._tag_entries(rows)]
+        counts = numpy.bincount(tag_ids, minlength=len(self.tag_names))
+        return dict((self.tag_names[i], int(counts[i])) for i in numpy.flatnonzero(counts))
+
+    def users_per_tag(self, rows=None):
+        """Returns a dictionary mapping tags to the number of distinct users who used them.
+
+        @param rows: Optional, default: None (all rows).
+            Restrict the query to these rows (see select()).
+        @type rows: NumPy array
 
         """
-        total_tags = {}
-        for user, tags, comment, timestamp in self.bookmarks:
-            for tag in tags:
-                total_tags[tag] = total_tags.get(tag, 0) + 1
-        return total_tags
-    tags = property(fget=get_tags, doc="Returns a dictionary mapping tags to their tag count")
+        arrays = self._get_arrays()
+        entries = self._tag_entries(rows)
+        pairs = arrays['tag'][entries] * len(self.users) + arrays['user'][arrays['tag_row'][entries]]
+        tag_ids = numpy.unique(pairs) // max(len(self.users), 1)
+        counts = numpy.bincount(tag_ids, minlength=len(self.tag_names))
+        return dict((self.tag_names[i], int(counts[i])) for i in numpy.flatnonzero(counts))
 
-    def get_hash(self):
-        m = hashlib.md5()
-        m.update(self.url)
-        return m.hexdigest()
-    hash = property(fget=get_hash, doc="Returns the MD5 hash of the URL of this document")
+
+class _HTTPConnectionPool(object):
+    """Keeps persistent HTTP/1.1 connections to Delicious.com for reuse.
+
+    Idle connections are pooled per (scheme, host, proxy) so that subsequent
+    queries to the same host skip the TCP (and SSL) handshake. At most
+    pool_size idle connections are kept per host, and connections that have
+    been idle for longer than idle_seconds are closed instead of reused.
+
+    The pool is thread-safe; a connection is used by one request at a time.
+
+    """
+
+    def __init__(self, pool_size=2, idle_seconds=30, timeout=30):
+        self.pool_size = pool_size
+        self.idle_seconds = idle_seconds
+        self.timeout = timeout
+        # maps (scheme, host, proxy) to a list of (connection, release_time)
+        # tuples, least recently released first
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _evict(self, idle, now):
+        """Closes connections of the given idle list which have expired."""
+        while idle and now - idle[0][1] > self.idle_seconds:
+            conn, released = idle.pop(0)
+            conn.close()
+
+    def _acquire(self, key):
+        """Returns a (connection, reused) tuple for the given pool key."""
+        now = time.time()
+        self._lock.acquire()
+        try:
+            idle = self._idle.get(key)
+            if idle:
+                self._evict(idle, now)
+                if idle:
+                    conn, released = idle.pop()
+                    return conn, True
+        finally:
+            self._lock.release()
+        scheme, host, proxy = key
+        if proxy:
+            conn = httplib.HTTPConnection(proxy, timeout=self.timeout)
+        elif scheme == "https":
+            conn = httplib.HTTPSConnection(host, timeout=self.timeout)
+        else:
+            conn = httplib.HTTPConnection(host, timeout=self.timeout)
+        return conn, False
+
+    def _release(self, key, conn):
+        """Puts a connection back into the pool after a complete response."""
+        now = time.time()
+        self._lock.acquire()
+        try:
+            idle = self._idle.setdefault(key, [])
+            self._evict(idle, now)
+            idle.append( (conn, now) )
+            while len(idle) > self.pool_size:
+                oldest, released = idle.pop(0)
+                oldest.close()
+        finally:
+            self._lock.release()
+
+    def urlopen(self, url, headers=None, proxy=None, stream=False):
+        """Sends a GET request for url over a pooled connection.
+
+        @param url: The absolute http:// or https:// URL to retrieve.
+        @type url: str
+
+        @param headers: Optional, default: None.
+            Additional HTTP request headers.
+        @type headers: dict
+
+        @param proxy: Optional, default: None.
+            HTTP proxy in "hostname:port" format. The proxy is only used
+            for http:// URLs.
+        @type proxy: str
+
+        @param stream: Optional, default: False.
+            If True, the body of a successful (2xx) response is not read but
+            returned as a file-like object, which must be closed after use.
+        @type stream: bool
+
+        @return: Tuple of (status, message, body), where message is the
+            httplib.HTTPMessage holding the response headers.
+
+        """
+        scheme, host, path, query, fragment = urlparse.urlsplit(url)
+        selector = path or "/"
+        if query:
+            selector = "%s?%s" % (selector, query)
+        if scheme != "http":
+            proxy = None
+        if proxy:
+            # proxies expect the absolute URL in the request line
+            selector = "%s://%s%s" % (scheme, host, selector)
+        key = (scheme, host, proxy or None)
+
+        while True:
+            conn, reused = self._acquire(key)
+            try:
+                conn.request("GET", selector, headers=headers or {})
+                response = conn.getresponse()
+                if stream and 200 <= response.status < 300:
+                    return response.status, response.msg, _PooledResponse(self, key, conn, response)
+                body = response.read()
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+                if reused:
+                    # the server has most probably closed the idle keep-alive
+                    # connection in the meantime, so try again on another one
+                    continue
+                raise
+            if response.will_close:
+                conn.close()
+            else:
+                self._release(key, conn)
+            return response.status, response.msg, body
+
+    def close(self):
+        """Closes all idle connections."""
+        self._lock.acquire()
+        try:
+            for idle in self._idle.values():
+                for conn, released in idle:
+                    conn.close()
+            self._idle = {}
+        finally:
+            self._lock.release()
+
+
+class _PooledResponse(object):
+    """File-like body of a streamed response.
+
+    Once closed, the underlying connection is put back into the pool if the
+    body has been read completely, and closed otherwise.
+
+    """
+
+    def __init__(self, pool, key, conn, response):
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._response = response
+
+    def read(self, amt=None):
+        return self._response.read(amt)
+
+    def close(self):
+        if self._conn is None:
+            return
+        if self._response.isclosed() and not self._response.will_close:
+            self._pool._release(self._key, self._conn)
+        else:
+            self._conn.close()
+        self._conn = None
+
+
+class _TeeReader(object):
+    """File-like wrapper which copies everything read from a stream to a file."""
+
+    def __init__(self, stream, copy_file):
+        self._stream = stream
+        self._copy_file = copy_file
+
+    def read(self, amt=None):
+        data = self._stream.read(amt)
+        self._copy_file.write(data)
+        return data
+
+
+class DeliciousResponseCache(object):
+    """An optional on-disk cache for Delicious.com responses.
+
+    Responses are stored in one file per query below directory, keyed by
+    host, path and the Delicious.com username (if any) that the query was
+    made for. A cached response is served without contacting Delicious.com
+    as long as it is younger than the time-to-live (TTL) of its endpoint.
+    Expired responses are revalidated with a conditional request
+    (If-None-Match/If-Modified-Since) if Delicious.com sent an ETag or
+    Last-Modified header, and reused if Delicious.com answers with
+    304 Not Modified.
+
+    When the total size of the cached responses exceeds max_size, the
+    least recently used responses are removed.
+
+    DeliciousAPI does not cache responses to queries sent with a password,
+    e.g. to the official API: they may contain private bookmarks, and a
+    cached response must not be returned for a wrong password.
+
+    Variables:
+        hits:
+            Number of queries answered from the cache without any request.
+
+        misses:
+            Number of queries for which no cached response was available.
+
+        revalidations:
+            Number of expired responses that were reused after a
+            304 Not Modified response.
+
+    """
+
+    # default TTLs in seconds by path prefix; the longest matching prefix wins
+    default_ttls = {
+        "/v2/json/urlinfo/": 60 * 60,
+        "/v2/json/tags/": 24 * 60 * 60,
+        "/v2/json/networkmembers/": 24 * 60 * 60,
+        "/v2/json/networkfans/": 24 * 60 * 60,
+    }
+
+    def __init__(self, directory, max_size=50*1024*1024, default_ttl=10*60, ttls=None):
+        """
+        @param directory: The directory to store cached responses in. It is
+            created if it does not exist yet.
+        @type directory: str
+
+        @param max_size: Optional, default: 50 MB.
+            Maximum total size in bytes of all cached responses.
+        @type max_size: int
+
+        @param default_ttl: Optional, default: 600.
+            Number of seconds a cached response is considered fresh if
+            no TTL is configured for its endpoint.
+        @type default_ttl: int
+
+        @param ttls: Optional, default: None.
+            Dictionary mapping path prefixes (e.g. "/v2/json/urlinfo/")
+            to TTLs in seconds. Overrides and extends default_ttls.
+        @type ttls: dict
+
+        """
+        assert directory
+        assert max_size >= 0
+        assert default_ttl >= 0
+        self.directory = directory
+        self.max_size = max_size
+        self.default_ttl = default_ttl
+        self.ttls = dict(self.default_ttls)
+        if ttls:
+            self.ttls.update(ttls)
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # maps cache keys to (last_used, size) tuples
+        self._index = {}
+        self._size = 0
+        for name in os.listdir(directory):
+            filename = os.path.join(directory, name)
+            if name.endswith(".tmp") or not os.path.isfile(filename):
+                continue
+            stat = os.stat(filename)
+            self._index[name] = (stat.st_mtime, stat.st_size)
+            self._size += stat.st_size
+
+    def __str__(self):
+        return "%d cached responses (%d bytes), %d hits, %d misses, %d revalidations" % \
+                    (len(self._index), self._size, self.hits, self.misses, self.revalidations)
+
+    def _key(self, host, path, user):
+        parts = []
+        for part in (host, path, user or ""):
+            if isinstance(part, unicode):
+                part = part.encode('utf-8')
+            parts.append(part)
+        return hashlib.sha1("\n".join(parts)).hexdigest()
+
+    def get_ttl(self, path):
+        """Returns the TTL in seconds for responses of the given query path."""
+        ttl = self.default_ttl
+        matched = ""
+        for prefix, prefix_ttl in self.ttls.iteritems():
+            if path.startswith(prefix) and len(prefix) > len(matched):
+                matched, ttl = prefix, prefix_ttl
+        return ttl
+
+    def lookup(self, host, path, user=None):
+        """Returns a (entry, fresh) tuple for the given query.
+
+        entry is a dictionary with the keys 'stored', 'etag', 'last_modified'
+        and 'body', or None if the query has no cached response. fresh tells
+        whether the response can be used without revalidation.
+
+        """
+        key = self._key(host, path, user)
+        entry = None
+        if key in self._index:
+            try:
+                f = open(os.path.join(self.directory, key), 'rb')
+                try:
+                    entry = cPickle.load(f)
+                finally:
+                    f.close()
+            except (IOError, EOFError, cPickle.UnpicklingError):
+                self._remove(key)
+        self._lock.acquire()
+        try:
+            if entry is None:
+                self.misses += 1
+                return None, False
+            fresh = time.time() - entry['stored'] <= self.get_ttl(path)
+            if fresh:
+                self.hits += 1
+                self._touch(key)
+            return entry, fresh
+        finally:
+            self._lock.release()
+
+    def store(self, host, path, user, body, msg):
+        """Caches the response body of a query along with its validators.
+
+        @param msg: The response headers.
+        @type msg: httplib.HTTPMessage
+
+        """
+        entry = {
+            'stored': time.time(),
+            'etag': msg and msg.getheader('etag'),
+            'last_modified': msg and msg.getheader('last-modified'),
+            'body': body,
+        }
+        self._write(self._key(host, path, user), entry)
+
+    def revalidated(self, host, path, user, entry):
+        """Marks an expired entry as fresh again after a 304 Not Modified response."""
+        self._lock.acquire()
+        try:
+            self.revalidations += 1
+        finally:
+            self._lock.release()
+        entry['stored'] = time.time()
+        self._write(self._key(host, path, user), entry)
+
+    def clear(self):
+        """Removes all cached responses."""
+        for key in self._index.keys():
+            self._remove(key)
+
+    def _touch(self, key):
+        # must be called with the lock held
+        last_used, size = self._index[key]
+        now = time.time()
+        self._index[key] = (now, size)
+        try:
+            os.utime(os.path.join(self.directory, key), (now, now))
+        except OSError:
+            pass
+
+    def _write(self, key, entry):
+        filename = os.path.join(self.directory, key)
+        tmp_filename = "%s.%s.tmp" % (filename, threading.current_thread().ident)
+        f = open(tmp_filename, 'wb')
+        try:
+            cPickle.dump(entry, f, cPickle.HIGHEST_PROTOCOL)
+        finally:
+            f.close()
+        os.rename(tmp_filename, filename)
+        size = os.path.getsize(filename)
+        self._lock.acquire()
+        try:
+            if key in self._index:
+                self._size -= self._index[key][1]
+            self._index[key] = (time.time(), size)
+            self._size += size
+            if self._size > self.max_size:
+                # evict least recently used responses
+                for last_used, old_key in sorted((v[0], k) for k, v in self._index.iteritems()):
+                    if self._size <= self.max_size:
+                        break
+                    self._unlink(old_key)
+        finally:
+            self._lock.release()
+
+    def _remove(self, key):
+        self._lock.acquire()
+        try:
+            if key in self._index:
+                self._unlink(key)
+        finally:
+            self._lock.release()
+
+    def _unlink(self, key):
+        # must be called with the lock held
+        last_used, size = self._index.pop(key)
+        self._size -= size
+        try:
+            os.remove(os.path.join(self.directory, key))
+        except OSError:
+            pass
+
+
+class DeliciousRateLimiter(object):
+    """Paces queries to Delicious.com across threads and processes.
+
+    A single DeliciousRateLimiter instance can be shared by any number of
+    threads (and DeliciousAPI instances). It ensures that queries are
+    started at most 'rate' times per second in total, no matter how many
+    queries are run concurrently.
+
+    The limiter is a token bucket: up to 'burst' queries may be sent at
+    once after a quiet period, but never more than 'rate' queries per
+    second on average. Hosts can be given budgets of their own, e.g.
+
+        DeliciousRateLimiter(rate=1.0, host_rates={
+            "feeds.delicious.com": 2.0,
+            "api.del.icio.us": 1.0,
+        })
+
+    paces the API and the feeds independently of each other and of all
+    other hosts, which share the default budget.
+
+    If a state file is given, the limiter keeps its state in that file,
+    guarded by an exclusive file lock (on platforms with fcntl). All
+    limiters with the same state file -- in any number of processes on the
+    same machine -- then share one set of budgets. They should be created
+    with the same rates.
+
+    """
+
+    DEFAULT_BUCKET = "*"
+
+    def __init__(self, rate=1.0, burst=1, host_rates=None, filename=None):
+        """
+        @param rate: Optional, default: 1.0.
+            Maximum number of queries per second. rate must be > 0.
+        @type rate: float
+
+        @param burst: Optional, default: 1.
+            Maximum number of queries which may be sent at once, i.e. the
+            size of the token bucket. burst must be >= 1.
+        @type burst: int
+
+        @param host_rates: Optional, default: None.
+            Maps host names to their own maximum number of queries per
+            second. Queries to other hosts share the default budget.
+        @type host_rates: dict
+
+        @param filename: Optional, default: None.
+            The state file to share the budgets between processes.
+        @type filename: str
+
+        """
+        assert rate > 0
+        assert burst >= 1
+        assert filename is None or fcntl is not None, "sharing a rate limiter between processes requires fcntl"
+        self.rate = rate
+        self.burst = burst
+        self.host_rates = dict(host_rates or {})
+        assert min(self.host_rates.values() or [rate]) > 0
+        self.filename = filename
+        # theoretical arrival time of the next query per bucket (GCRA); a
+        # query may start once it is at most (burst - 1) intervals ahead
+        self._next_time = {}
+        self._lock = threading.Lock()
+
+    def _get_bucket(self, host):
+        """Returns the bucket and the rate which apply to queries to host."""
+        if host in self.host_rates:
+            return host, self.host_rates[host]
+        return self.DEFAULT_BUCKET, self.rate
+
+    def _reserve(self, next_times, bucket, rate, now):
+        """Reserves a query slot in a bucket and returns its start time."""
+        interval = 1.0 / rate
+        next_time = max(now, next_times.get(bucket, 0))
+        start = max(now, next_time - (self.burst - 1) * interval)
+        next_times[bucket] = next_time + interval
+        return start
+
+    def acquire(self, host=None):
+        """Blocks until the next query may be sent.
+
+        @param host: Optional, default: None.
+            The host to be queried.
+        @type host: str
+
+        """
+        bucket, rate = self._get_bucket(host)
+        self._lock.acquire()
+        try:
+            if self.filename is None:
+                now = time.time()
+                start = self._reserve(self._next_time, bucket, rate, now)
+            else:
+                state_file = open(self.filename, "a+")
+                try:
+                    fcntl.flock(state_file.fileno(), fcntl.LOCK_EX)
+                    state_file.seek(0)
+                    next_times = {}
+                    for line in state_file:
+                        fields = line.split()
+                        if len(fields) == 2:
+                            try:
+                                next_times[fields[0]] = float(fields[1])
+                            except ValueError:
+                                pass
+                    now = time.time()
+                    start = self._reserve(next_times, bucket, rate, now)
+                    state_file.seek(0)
+                    state_file.truncate()
+                    state_file.write("".join("%s %.6f\n" % item for item in next_times.iteritems()))
+                    state_file.flush()
+                finally:
+                    # closing the file releases the lock
+                    state_file.close()
+        finally:
+            self._lock.release()
+        if start > now:
+            time.sleep(start - now)
+
+
+class DeliciousThrottleGovernor(object):
+    """Adapts the request rate to the throttling behaviour of Delicious.com.
+
+    The governor keeps a separate state for every host:
+
+      - Requests are paced at an adaptive rate (AIMD): every successful
+        request raises the rate by roughly `increase` requests per second
+        per second of traffic, every throttled request (HTTP 503/999)
+        multiplies it by `decrease`. The rate settles just below the level
+        at which the host starts to throttle.
+
+      - Throttled requests and connection failures open a circuit for the
+        host. While the circuit is open, callers wait (or, if `block` is
+        False, fail immediately with DeliciousThrottleError). The circuit
+        stays open for an exponentially growing backoff time with random
+        jitter, or for as long as the host asked for in a Retry-After
+        header. Afterwards, a single probe request is let through; the
+        circuit is closed when it succeeds and opened again otherwise.
+
+    A governor can be shared by any number of threads and DeliciousAPI
+    instances.
+
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+    # time after which an unanswered probe request is given up
+    PROBE_SECONDS = 60
+
+    def __init__(self, rate=1.0, min_rate=0.05, max_rate=10.0, increase=0.05, decrease=0.5,
+                 backoff_seconds=5.0, max_backoff_seconds=600.0, failure_threshold=3, block=True):
+        """
+        @param rate: Optional, default: 1.0.
+            Initial number of requests per second per host.
+        @type rate: float
+
+        @param min_rate: Optional, default: 0.05.
+            Lower bound of the request rate.
+        @type min_rate: float
+
+        @param max_rate: Optional, default: 10.0.
+            Upper bound of the request rate.
+        @type max_rate: float
+
+        @param increase: Optional, default: 0.05.
+            Additive rate increase, see above.
+        @type increase: float
+
+        @param decrease: Optional, default: 0.5.
+            Multiplicative rate decrease on throttling, 0 < decrease < 1.
+        @type decrease: float
+
+        @param backoff_seconds: Optional, default: 5.0.
+            Time for which the circuit is opened after the first failure.
+            The time doubles with every further consecutive failure.
+        @type backoff_seconds: float
+
+        @param max_backoff_seconds: Optional, default: 600.0.
+            Upper bound of the backoff time.
+        @type max_backoff_seconds: float
+
+        @param failure_threshold: Optional, default: 3.
+            Number of consecutive connection failures (as opposed to
+            throttled requests, which open the circuit immediately) after
+            which the circuit is opened.
+        @type failure_threshold: int
+
+        @param block: Optional, default: True.
+            Whether callers wait while the circuit of a host is open, or
+            fail with DeliciousThrottleError.
+        @type block: bool
+
+        """
+        assert 0 < min_rate <= rate <= max_rate
+        assert 0 < decrease < 1
+        assert failure_threshold >= 1
+        self.initial_rate = float(rate)
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        self.increase = float(increase)
+        self.decrease = float(decrease)
+        self.backoff_seconds = float(backoff_seconds)
+        self.max_backoff_seconds = float(max_backoff_seconds)
+        self.failure_threshold = failure_threshold
+        self.block = block
+        self._hosts = {}
+        self._condition = threading.Condition()
+
+    def _get_host(self, host):
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = {
+                'rate': self.initial_rate,
+                'next_time': 0,
+                'circuit': self.CLOSED,
+                'open_until': 0,
+                'probing': False,
+                'probe_until': 0,
+                'failures': 0,
+                'requests': 0,
+                'throttled': 0,
+            }
+        return state
+
+    def get_rate(self, host):
+        """Returns the current request rate for host."""
+        self._condition.acquire()
+        try:
+            return self._get_host(host)['rate']
+        finally:
+            self._condition.release()
+
+    def get_circuit(self, host):
+        """Returns the circuit state of host (CLOSED, OPEN or HALF_OPEN)."""
+        self._condition.acquire()
+        try:
+            return self._get_host(host)['circuit']
+        finally:
+            self._condition.release()
+
+    def acquire(self, host=None):
+        """Blocks until the next request to host may be sent.
+
+        @param host: Optional, default: None.
+            The host to be queried.
+        @type host: str
+
+        """
+        self._condition.acquire()
+        try:
+            state = self._get_host(host)
+            while True:
+                now = time.time()
+                if state['circuit'] == self.OPEN and now >= state['open_until']:
+                    state['circuit'] = self.HALF_OPEN
+                if state['circuit'] == self.CLOSED:
+                    break
+                if state['circuit'] == self.HALF_OPEN and (not state['probing'] or now >= state['probe_until']):
+                    # nobody is probing (any more, e.g. if the probing
+                    # thread died), so this caller becomes the probe
+                    break
+                if not self.block:
+                    raise DeliciousThrottleError, "Delicious.com host %s is throttling requests, retry in %.0f seconds" % (host, max(0, state['open_until'] - now))
+                if state['circuit'] == self.OPEN:
+                    self._condition.wait(state['open_until'] - now)
+                else:
+                    # wait for the outcome of the probe request
+                    self._condition.wait(1.0)
+            if state['circuit'] == self.HALF_OPEN:
+                state['probing'] = True
+                state['probe_until'] = now + self.PROBE_SECONDS
+            start = max(now, state['next_time'])
+            state['next_time'] = start + 1.0 / state['rate']
+            state['requests'] += 1
+        finally:
+            self._condition.release()
+        if start > now:
+            time.sleep(start - now)
+
+    def success(self, host=None):
+        """Records that a request to host has not been throttled."""
+        self._condition.acquire()
+        try:
+            state = self._get_host(host)
+            state['rate'] = min(self.max_rate, state['rate'] + self.increase / state['rate'])
+            state['failures'] = 0
+            if state['circuit'] != self.CLOSED:
+                state['circuit'] = self.CLOSED
+                state['probing'] = False
+                self._condition.notifyAll()
+        finally:
+            self._condition.release()
+
+    def throttled(self, host=None, retry_after=None):
+        """Records that a request to host has been throttled.
+
+        @param host: Optional, default: None.
+            The queried host.
+        @type host: str
+
+        @param retry_after: Optional, default: None.
+            The value of the Retry-After header of the response, if any.
+        @type retry_after: str
+
+        """
+        self._condition.acquire()
+        try:
+            state = self._get_host(host)
+            state['rate'] = max(self.min_rate, state['rate'] * self.decrease)
+            state['throttled'] += 1
+            state['failures'] += 1
+            self._open(state, self._parse_retry_after(retry_after))
+        finally:
+            self._condition.release()
+
+    def failed(self, host=None):
+        """Records that a request to host has failed with a connection error."""
+        self._condition.acquire()
+        try:
+            state = self._get_host(host)
+            state['failures'] += 1
+            if state['failures'] >= self.failure_threshold or state['circuit'] == self.HALF_OPEN:
+                self._open(state)
+            else:
+                # let the caller retry after the regular backoff time
+                state['next_time'] = max(state['next_time'], time.time() + self._backoff(state))
+        finally:
+            self._condition.release()
+
+    def _backoff(self, state):
+        """Returns the backoff time for the current number of consecutive failures, with jitter."""
+        exponent = min(state['failures'] - 1, 30)
+        backoff = min(self.max_backoff_seconds, self.backoff_seconds * 2 ** exponent)
+        # "equal jitter": spread retries of concurrent clients over the
+        # second half of the backoff interval
+        return backoff / 2 + random.uniform(0, backoff / 2)
+
+    def _open(self, state, retry_after=None):
+        """Opens the circuit of a host (the caller holds the lock)."""
+        wait = self._backoff(state)
+        if retry_after is not None:
+            wait = max(wait, retry_after)
+        state['circuit'] = self.OPEN
+        state['probing'] = False
+        state['open_until'] = time.time() + wait
+        self._condition.notifyAll()
+
+    def _parse_retry_after(self, retry_after):
+        """Returns the number of seconds of a Retry-After header value, or None."""
+        if not retry_after:
+            return None
+        retry_after = retry_after.strip()
+        if retry_after.isdigit():
+            return int(retry_after)
+        try:
+            parsed = email.utils.parsedate_tz(retry_after)
+        except (TypeError, ValueError):
+            return None
+        if parsed is None:
+            return None
+        return max(0, email.utils.mktime_tz(parsed) - time.time())
+
+
+class _DeliciousPageParser(HTMLParser.HTMLParser):
+    """Event-driven extraction of records from Delicious.com result pages.
+
+    This parser produces the same records and next page links as the
+    BeautifulSoup based extraction methods of DeliciousAPI, but does so in
+    a single pass over the HTML source without building a document tree,
+    which makes it considerably faster.
+
+    To produce identical output, text and attribute values are extracted
+    the same way as BeautifulSoup 3 does it: entity and character
+    references in text are kept as they are, while in attribute values
+    only the basic XML entities and numeric character references are
+    converted.
+
+    """
+
+    # references converted by sgmllib, which BeautifulSoup 3 is based on
+    _sgml_ref = re.compile('&(?:([a-zA-Z][-.a-zA-Z0-9]*)|#([0-9]+))(;?)')
+    _sgml_entities = {'lt': u'<', 'gt': u'>', 'amp': u'&', 'quot': u'"', 'apos': u"'"}
+    # numeric references converted by BeautifulSoup 3 itself afterwards
+    _numeric_ref = re.compile('&(#\d+|#x[0-9a-fA-F]+);')
+
+    def __init__(self, kind):
+        """
+        @param kind: The kind of result page: "url", "user" or "tag" (see
+            DeliciousAPI._parse_page()).
+        @type kind: str
+
+        """
+        HTMLParser.HTMLParser.__init__(self)
+        self.kind = kind
+        # bookmark records (dictionaries) in document order
+        self.records = []
+        self.urls = []
+        self.next_path = None
+        self._div_depth = 0
+        # bookmark records whose <div> element has not been closed yet
+        self._open = []
+        # user pages only contain bookmarks within <ul id="bookmarklist">
+        self._ul_depth = 0
+        self._list_depth = None
+        self._list_seen = kind != "user"
+        self._pagination_depth = None
+        self._pagination_seen = False
+        # (record, field) targets waiting for the text of the current element
+        self._capture = []
+        self._text = []
+
+    def unescape(self, s):
+        # called by HTMLParser for attribute values
+        if '&' not in s:
+            return s
+        s = self._sgml_ref.sub(self._convert_sgml_ref, s)
+        return self._numeric_ref.sub(self._convert_numeric_ref, s)
+
+    def _convert_sgml_ref(self, match):
+        name, number, semicolon = match.groups()
+        if number:
+            if int(number) <= 127:
+                return unichr(int(number))
+            return u'&#%s%s' % (number, semicolon)
+        if semicolon:
+            return self._sgml_entities.get(name, u'&%s;' % name)
+        return u'&%s' % name
+
+    def _convert_numeric_ref(self, match):
+        ref = match.group(1)
+        if ref[1] == 'x':
+            return unichr(int(ref[2:], 16))
+        return unichr(int(ref[1:]))
+
+    def _start_capture(self, targets):
+        self._capture = targets
+        self._text = []
+
+    def _end_capture(self):
+        # the first child of an element is text only if text comes
+        # before any other tag
+        if self._capture and self._text:
+            text = u"".join(self._text)
+            for record, field in self._capture:
+                if field == 'tags':
+                    record['tags'].append(text)
+                else:
+                    record[field] = text
+        self._capture = []
+        self._text = []
+
+    def handle_data(self, data):
+        if self._capture:
+            self._text.append(data)
+
+    def handle_entityref(self, name):
+        if self._capture:
+            self._text.append(u"&%s;" % name)
+
+    def handle_charref(self, name):
+        if self._capture:
+            self._text.append(u"&#%s;" % name)
+
+    def handle_comment(self, data):
+        # a comment is a text node of its own in BeautifulSoup
+        if self._capture and not self._text:
+            self._text.append(data)
+        self._end_capture()
+
+    def handle_starttag(self, tag, attrs):
+        self._end_capture()
+        if tag == 'div':
+            self._div_depth += 1
+            self._start_div(dict(attrs))
+        elif tag == 'a':
+            self._start_a(dict(attrs))
+        elif tag == 'span':
+            targets = []
+            for record in self._open:
+                if record['dategroup'] == 'open':
+                    # only the first <span> of the first dateGroup counts
+                    record['dategroup'] = 'done'
+                    targets.append( (record, 'date') )
+            self._start_capture(targets)
+        elif tag == 'ul':
+            self._ul_depth += 1
+            if not self._list_seen and dict(attrs).get('id') == 'bookmarklist':
+                self._list_seen = True
+                self._list_depth = self._ul_depth
+
+    def handle_endtag(self, tag):
+        self._end_capture()
+        if tag == 'div' and self._div_depth > 0:
+            depth = self._div_depth
+            for record in self._open:
+                for feature in ('dategroup', 'data', 'description', 'tagdisplay', 'meta'):
+                    if record[feature] == 'open' and record[feature + '_depth'] == depth:
+                        record[feature] = 'done'
+            self._open = [record for record in self._open if record['depth'] != depth]
+            if self._pagination_depth == depth:
+                self._pagination_depth = None
+            self._div_depth -= 1
+        elif tag == 'ul' and self._ul_depth > 0:
+            if self._list_depth == self._ul_depth:
+                self._list_depth = None
+            self._ul_depth -= 1
+
+    def _open_feature(self, record, feature):
+        record[feature] = 'open'
+        record[feature + '_depth'] = self._div_depth
+
+    def _start_div(self, attrs):
+        css_class = attrs.get('class')
+        depth = self._div_depth
+        if attrs.get('id') == 'pagination' and not self._pagination_seen:
+            self._pagination_seen = True
+            self._pagination_depth = depth
+        if css_class is None:
+            return
+        for record in self._open:
+            if css_class == 'dateGroup' and record['dategroup'] is None:
+                self._open_feature(record, 'dategroup')
+            elif css_class == 'data' and record['data'] is None:
+                self._open_feature(record, 'data')
+            elif css_class == 'description' and record['data'] == 'open' and record['description'] is None:
+                self._open_feature(record, 'description')
+                self._capture.append( (record, 'comment') )
+            elif css_class == 'tagdisplay' and record['tagdisplay'] is None:
+                self._open_feature(record, 'tagdisplay')
+            elif css_class == 'meta' and record['meta'] is None:
+                self._open_feature(record, 'meta')
+        if css_class.startswith('bookmark') and self.kind != "tag" and \
+                (self.kind == "url" or self._list_depth is not None):
+            record = {
+                'depth': depth,
+                'dategroup': None,
+                'data': None,
+                'description': None,
+                'tagdisplay': None,
+                'meta': None,
+                # the user link of a URL history entry and the title link
+                # of a user's bookmark are tracked independently
+                'user_link': None,
+                'title_link': None,
+                'tags': [],
+            }
+            self.records.append(record)
+            self._open.append(record)
+
+    def _start_a(self, attrs):
+        css_class = attrs.get('class')
+        if css_class is None:
+            return
+        href = attrs.get('href')
+        if self._pagination_depth is not None and css_class == 'pn next':
+            self._pagination_depth = None
+            self.next_path = href
+        if self.kind == "tag":
+            if css_class.startswith('taggedlink') and href:
+                self.urls.append(href)
+            return
+        targets = []
+        for record in self._open:
+            if css_class == 'tag noplay' and record['tagdisplay'] == 'open':
+                targets.append( (record, 'tags') )
+            elif css_class == 'user user-tag' and record['meta'] == 'open' and record['user_link'] is None:
+                record['user_link'] = 'done'
+                if href is not None:
+                    record['user'] = href[1:]
+            elif css_class.startswith('taggedlink') and record['data'] == 'open' and record['title_link'] is None:
+                record['title_link'] = 'done'
+                record['href'] = href
+                targets.append( (record, 'title') )
+        self._start_capture(targets)
+
+    def get_records(self):
+        """Returns the extracted records as a list of bookmark tuples or URLs."""
+        self.close()
+        self._end_capture()
+        if self.kind == "tag":
+            return self.urls
+        bookmarks = []
+        timestamp = None
+        for record in self.records:
+            # this timestamp has to "persist" until a new timestamp is found
+            if 'date' in record:
+                timestamp = datetime.datetime.strptime(record['date'].strip(), '%d %b %y')
+            comment = record.get('comment', u"").strip()
+            if self.kind == "url":
+                if 'user' in record:
+                    bookmarks.append(DeliciousURLBookmark(record['user'], record['tags'], comment, timestamp))
+            else:
+                url = title = u""
+                if 'title' in record:
+                    title = record['title'].strip()
+                    url = record['href']
+                bookmarks.append(DeliciousUserBookmark(url, record['tags'], title, comment, timestamp))
+        return bookmarks
+
+
+def _parse_page_fast(data, kind):
+    """Extracts records and next page link from a result page with _DeliciousPageParser.
+
+    See DeliciousAPI._parse_page() for parameters and return value.
+
+    """
+    if isinstance(data, str):
+        try:
+            data = data.decode('utf-8')
+        except UnicodeDecodeError:
+            data = data.decode('windows-1252', 'replace')
+    parser = _DeliciousPageParser(kind)
+    parser.feed(data)
+    records = parser.get_records()
+    return records, parser.next_path
+
+
+def _scan_next_path(data):
+    """Returns the path of the next result page without parsing the whole page.
+
+    Only the part of the HTML source starting at the pagination <div> is
+    parsed, which is much cheaper than extracting all records of the page.
+
+    """
+    match = _pagination_start.search(data)
+    if match is None:
+        return None
+    data = data[match.start():]
+    if isinstance(data, str):
+        try:
+            data = data.decode('utf-8')
+        except UnicodeDecodeError:
+            data = data.decode('windows-1252', 'replace')
+    parser = _DeliciousPageParser("tag")
+    parser.feed(data)
+    parser.close()
+    return parser.next_path
+
+# the page number in the path of a result page of Delicious.com
+_page_number = re.compile(r"[?&]page=(\d+)(?=&|$)")
+
+_pagination_start = re.compile(r"""<div\s[^>]*\bid\s*=\s*["']?pagination\b""", re.IGNORECASE)
+
+
+def _record_key(record):
+    """Returns a hashable key of a record of a result page (see DeliciousAPI._parse_page())."""
+    if not isinstance(record, tuple):
+        return record
+    key = []
+    for field in record:
+        if isinstance(field, list):
+            # e.g. the tags of a bookmark
+            field = tuple(field)
+        key.append(field)
+    return tuple(key)
+
+
+def _parse_page_in_process(data, kind, parser):
+    """Parses a result page in a worker process of DeliciousAPI's parse pool.
+
+    See DeliciousAPI._parse_page() for parameters and return value.
+
+    """
+    return DeliciousAPI(parser=parser)._parse_page(data, kind)
+
+
+class DeliciousProxyPool(object):
+    """Distributes queries to Delicious.com across several HTTP proxies.
+
+    Every query is sent through one proxy of the pool, chosen either in
+    turn ("round-robin") or by the smallest number of queries currently in
+    flight ("least-loaded"). A proxy whose query was throttled (HTTP 503 or
+    999), or which failed max_failures times in a row with a connection
+    error, is taken out of the pool for ban_seconds. The ban time doubles
+    with every further ban in a row. If all proxies are banned, callers
+    wait for the first one to come back (see acquire()).
+
+    Optionally, every proxy gets a request budget of its own (see
+    DeliciousRateLimiter).
+
+    A proxy pool can be shared by any number of threads and DeliciousAPI
+    instances.
+
+    """
+
+    OK, THROTTLED, FAILED = "ok", "throttled", "failed"
+
+    def __init__(self, proxies, strategy="round-robin", rate=None, ban_seconds=300, max_ban_seconds=3600, max_failures=2):
+        """
+        @param proxies: The HTTP proxies ("hostname:port").
+        @type proxies: list of str
+
+        @param strategy: Optional, default: "round-robin".
+            How to choose the proxy of a query, "round-robin" or "least-loaded".
+        @type strategy: str
+
+        @param rate: Optional, default: None.
+            Maximum number of queries per second per proxy. If None, the
+            queries through a proxy are not paced.
+        @type rate: float
+
+        @param ban_seconds: Optional, default: 300.
+            Time for which a proxy is taken out of the pool.
+        @type ban_seconds: float
+
+        @param max_ban_seconds: Optional, default: 3600.
+            Upper bound of the ban time.
+        @type max_ban_seconds: float
+
+        @param max_failures: Optional, default: 2.
+            Number of consecutive connection errors after which a proxy
+            is banned.
+        @type max_failures: int
+
+        """
+        assert proxies
+        assert strategy in ("round-robin", "least-loaded")
+        assert max_failures >= 1
+        self.strategy = strategy
+        self.ban_seconds = ban_seconds
+        self.max_ban_seconds = max_ban_seconds
+        self.max_failures = max_failures
+        self.proxies = list(proxies)
+        self._stats = {}
+        for proxy in self.proxies:
+            self._stats[proxy] = {
+                'in_flight': 0,
+                'banned_until': 0,
+                'bans': 0,
+                'failures': 0,
+                'requests': 0,
+                'throttled': 0,
+                'limiter': rate and DeliciousRateLimiter(rate) or None,
+            }
+        self._next = 0
+        self._condition = threading.Condition()
+
+    def get_stats(self, proxy):
+        """Returns a dict of the counters of proxy (requests, throttled, in_flight, ...)."""
+        self._condition.acquire()
+        try:
+            stats = dict(self._stats[proxy])
+            del stats['limiter']
+            return stats
+        finally:
+            self._condition.release()
+
+    def acquire(self, block=True):
+        """Returns the proxy to send the next query through.
+
+        The caller must pass the proxy to release() once the query is done.
+
+        @param block: Optional, default: True.
+            If all proxies are banned, wait for the first one to come back.
+            If False, return None right away instead.
+        @type block: bool
+
+        @return: The proxy ("hostname:port"), or None if all proxies are
+            banned and block is False.
+
+        """
+        self._condition.acquire()
+        try:
+            while True:
+                now = time.time()
+                available = [proxy for proxy in self.proxies if self._stats[proxy]['banned_until'] <= now]
+                if available:
+                    break
+                if not block:
+                    return None
+                # all proxies are banned; wait for the first one to return
+                self._condition.wait(min(self._stats[proxy]['banned_until'] for proxy in self.proxies) - now)
+            # start at the next proxy in turn, skipping banned ones
+            start = self._next % len(self.proxies)
+            candidates = [proxy for proxy in self.proxies[start:] + self.proxies[:start] if proxy in available]
+            proxy = candidates[0]
+            if self.strategy == "least-loaded":
+                # ties are broken in turn
+                proxy = min(candidates, key=lambda proxy: self._stats[proxy]['in_flight'])
+            self._next = self.proxies.index(proxy) + 1
+            stats = self._stats[proxy]
+            stats['in_flight'] += 1
+            stats['requests'] += 1
+        finally:
+            self._condition.release()
+        if stats['limiter'] is not None:
+            stats['limiter'].acquire()
+        return proxy
+
+    def release(self, proxy, outcome=OK):
+        """Records the outcome of a query sent through proxy.
+
+        @param proxy: The proxy returned by acquire().
+        @type proxy: str
+
+        @param outcome: Optional, default: DeliciousProxyPool.OK.
+            OK if the proxy got a regular response, THROTTLED if the
+            response was HTTP 503 or 999, FAILED on connection errors,
+            None if the query was not sent at all.
+        @type outcome: str
+
+        """
+        self._condition.acquire()
+        try:
+            stats = self._stats[proxy]
+            stats['in_flight'] -= 1
+            if outcome is None:
+                pass
+            elif outcome == self.OK:
+                stats['failures'] = 0
+                stats['bans'] = 0
+            else:
+                if outcome == self.THROTTLED:
+                    stats['throttled'] += 1
+                    ban = True
+                else:
+                    stats['failures'] += 1
+                    ban = stats['failures'] >= self.max_failures
+                if ban:
+                    ban_seconds = min(self.max_ban_seconds, self.ban_seconds * 2 ** min(stats['bans'], 30))
+                    stats['banned_until'] = time.time() + ban_seconds
+                    stats['bans'] += 1
+                    stats['failures'] = 0
+            self._condition.notifyAll()
+        finally:
+            self._condition.release()
 
 
 class DeliciousAPI(object):
@@ -264,6 +1930,14 @@ class DeliciousAPI(object):
                     wait_seconds=3,
                     user_agent="DeliciousAPI/%s (+http://www.michael-noll.com/wiki/Del.icio.us_Python_API)" % __version__,
                     timeout=30,
+                    pool_size=2,
+                    pool_idle_seconds=30,
+                    cache=None,
+                    rate_limiter=None,
+                    governor=None,
+                    parser="beautifulsoup",
+                    parse_processes=0,
+                    prefetch_pages=0,
         ):
         """Set up the API module.
 
@@ -271,7 +1945,12 @@ class DeliciousAPI(object):
             Use an HTTP proxy for HTTP connections. Proxy support for
             HTTPS is not available yet.
             Format: "hostname:port" (e.g., "localhost:8080")
-        @type http_proxy: str
+            To spread queries over several proxies, pass a list of proxies
+            or a DeliciousProxyPool. Throttled queries are then retried
+            (see tries) through another proxy. If all proxies are banned,
+            DeliciousThrottleError is raised instead of waiting for one
+            to come back.
+        @type http_proxy: str, list of str or DeliciousProxyPool
 
         @param tries: Optional, default: 3.
             Try the specified number of times when downloading a monitored
@@ -293,19 +1972,127 @@ class DeliciousAPI(object):
             Set network timeout. timeout must be >= 0.
         @type timeout: int
 
+        @param pool_size: Optional, default: 2.
+            Keep up to the specified number of idle HTTP/1.1 keep-alive
+            connections per host (and proxy) open for reuse by subsequent
+            queries. Set to 0 to open a new connection for every query.
+            pool_size must be >= 0.
+        @type pool_size: int
+
+        @param pool_idle_seconds: Optional, default: 30.
+            Close pooled connections which have not been used for the
+            specified number of seconds instead of reusing them.
+            pool_idle_seconds must be >= 0.
+        @type pool_idle_seconds: int
+
+        @param cache: Optional, default: None.
+            Cache responses of Delicious.com on disk and reuse them for
+            repeated queries. Queries sent with a password are not cached.
+            See DeliciousResponseCache.
+        @type cache: DeliciousResponseCache
+
+        @param rate_limiter: Optional, default: None.
+            Consult the given rate limiter before every query sent to
+            Delicious.com. Share a rate limiter between threads and
+            DeliciousAPI instances to bound their total request rate.
+        @type rate_limiter: DeliciousRateLimiter
+
+        @param governor: Optional, default: None.
+            Adapt the request rate to throttling by Delicious.com and back
+            off from throttling hosts. If set, throttled queries (HTTP 503
+            and 999) are retried (see tries) after the backoff time instead
+            of raising DeliciousThrottleError right away, and connection
+            errors are retried after the backoff time instead of
+            wait_seconds. See DeliciousThrottleGovernor.
+        @type governor: DeliciousThrottleGovernor
+
+        @param parser: Optional, default: "beautifulsoup".
+            The parser backend used to extract bookmarks and URLs from the
+            Web pages of Delicious.com. "beautifulsoup" always uses
+            BeautifulSoup. "htmlparser" uses a several times faster
+            single-pass extractor based on Python's HTMLParser and falls
+            back to BeautifulSoup for pages it cannot parse; run
+            check_parsers.py to compare the two backends.
+        @type parser: str
+
+        @param parse_processes: Optional, default: 0.
+            Parse the result pages of paginated queries (get_bookmarks(),
+            get_urls(), etc.) in a pool of the specified number of worker
+            processes, so that parsing a page overlaps with retrieving the
+            next one. Set to 0 to parse pages in the calling thread.
+            parse_processes must be >= 0.
+        @type parse_processes: int
+
+        @param prefetch_pages: Optional, default: 0.
+            Retrieve up to the specified number of result pages of paginated
+            queries concurrently. The paths of the following pages are
+            predicted from the link to page 2 and checked against the
+            actual pagination; mispredicted pages are discarded and the
+            pagination is followed page by page from there on. The
+            concurrent queries are paced by rate_limiter, or at one query
+            per sleep_seconds if there is none -- so set a rate_limiter to
+            benefit from this option. Set to 0 to retrieve pages one by
+            one. prefetch_pages must be >= 0. Overrides parse_processes for
+            paginated queries.
+        @type prefetch_pages: int
+
         """
         assert tries >= 1
         assert wait_seconds >= 0
         assert timeout >= 0
+        assert pool_size >= 0
+        assert pool_idle_seconds >= 0
+        assert parser in ("htmlparser", "beautifulsoup")
+        assert parse_processes >= 0
+        assert prefetch_pages >= 0
+        self.proxy_pool = None
+        if isinstance(http_proxy, DeliciousProxyPool):
+            self.proxy_pool = http_proxy
+            http_proxy = ""
+        elif isinstance(http_proxy, (list, tuple)):
+            self.proxy_pool = DeliciousProxyPool(http_proxy)
+            http_proxy = ""
         self.http_proxy = http_proxy
         self.tries = tries
         self.wait_seconds = wait_seconds
         self.user_agent = user_agent
         self.timeout = timeout
+        self.max_redirects = 10
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        self.governor = governor
+        self.parser = parser
+        self._parse_pool = None
+        if parse_processes > 0:
+            self._parse_pool = multiprocessing.Pool(parse_processes)
+        self.prefetch_pages = prefetch_pages
+        self._prefetch_pool = None
+        if prefetch_pages > 1:
+            self._prefetch_pool = ThreadPool(prefetch_pages)
         socket.setdefaulttimeout(self.timeout)
+        self._connections = _HTTPConnectionPool(pool_size=pool_size, idle_seconds=pool_idle_seconds, timeout=timeout)
 
+    def close(self):
+        """Closes all pooled HTTP connections to Delicious.com.
 
-    def _query(self, path, host="delicious.com", user=None, password=None, use_ssl=False):
+        The API instance remains usable afterwards; new connections are
+        opened on demand. Worker processes used for parsing (if any) are
+        shut down, and pages are parsed in the calling thread afterwards.
+        Likewise, pages are no longer prefetched.
+
+        """
+        self._connections.close()
+        if self._parse_pool is not None:
+            self._parse_pool.close()
+            self._parse_pool.join()
+            self._parse_pool = None
+        if self._prefetch_pool is not None:
+            self._prefetch_pool.close()
+            self._prefetch_pool.join()
+            self._prefetch_pool = None
+
+
+    def _query(self, path, host="delicious.com", user=None, password=None, use_ssl=False, stream=False):
         """Queries Delicious.com for information, specified by (query) path.
 
         @param path: The HTTP query path.
@@ -323,30 +2110,38 @@ class DeliciousAPI(object):
         @param use_ssl: Whether to use SSL encryption or not, default: False.
         @type use_ssl: bool
 
+        @param stream: Whether to return the response as a file-like object
+            instead of its content, default: False. The caller must close
+            the returned object. Streamed responses are not cached.
+        @type stream: bool
+
         @return: None on errors (i.e. on all HTTP status other than 200).
             On success, returns the content of the HTML response.
 
         """
-        opener = None
-        handlers = []
+        headers = {'User-Agent': self.user_agent}
 
         # add HTTP Basic authentication if available
         if user and password:
-            pwd_mgr = urllib2.HTTPPasswordMgrWithDefaultRealm()
-            pwd_mgr.add_password(None, host, user, password)
-            basic_auth_handler = urllib2.HTTPBasicAuthHandler(pwd_mgr)
-            handlers.append(basic_auth_handler)
-
-        # add proxy support if requested
-        if self.http_proxy:
-            proxy_handler = urllib2.ProxyHandler({'http': 'http://%s' % self.http_proxy})
-            handlers.append(proxy_handler)
-
-        if handlers:
-            opener = urllib2.build_opener(*handlers)
-        else:
-            opener = urllib2.build_opener()
-        opener.addheaders = [('User-agent', self.user_agent)]
+            if isinstance(password, unicode):
+                password = password.encode('utf-8')
+            credentials = base64.b64encode("%s:%s" % (user, password))
+            headers['Authorization'] = "Basic %s" % credentials
+
+        # responses to authenticated queries are not cached, see
+        # DeliciousResponseCache
+        cacheable = self.cache is not None and not stream and 'Authorization' not in headers
+        cached = None
+        if cacheable:
+            cached, fresh = self.cache.lookup(host, path, user)
+            if fresh:
+                return cached['body']
+            if cached:
+                # ask Delicious.com to send the response only if it has changed
+                if cached['etag']:
+                    headers['If-None-Match'] = cached['etag']
+                if cached['last_modified']:
+                    headers['If-Modified-Since'] = cached['last_modified']
 
         data = None
         tries = self.tries
@@ -357,39 +2152,103 @@ class DeliciousAPI(object):
             protocol = "http"
         url = "%s://%s%s" % (protocol, host, path)
 
+        redirects = 0
+        throttled = None
         while tries > 0:
+            proxy = self.http_proxy
+            # the proxy pool does not handle HTTPS
+            pooled = self.proxy_pool is not None and url.startswith("http:")
+            # throttling applies per client IP address, so the governor
+            # keeps track of each proxy separately
+            governor_key = host
+            if pooled:
+                # bans last for minutes, so do not wait for a proxy to
+                # come back
+                proxy = self.proxy_pool.acquire(block=False)
+                if proxy is None:
+                    if tries < self.tries:
+                        # give up as after the last try
+                        break
+                    raise DeliciousThrottleError, "Delicious.com error - all HTTP proxies are banned (throttled or unreachable)"
+                governor_key = "%s via %s" % (host, proxy)
+            # the outcome reported to the proxy pool; None if the query
+            # has not been sent, e.g. if the governor refuses to wait
+            outcome = None
             try:
-                f = opener.open(url)
-                data = f.read()
-                f.close()
-                break
-            except urllib2.HTTPError, e:
-                if e.code == 301:
-                    raise DeliciousMovedPermanentlyWarning, "Delicious.com status %s - url moved permanently" % e.code
-                if e.code == 302:
-                    raise DeliciousMovedTemporarilyWarning, "Delicious.com status %s - url moved temporarily" % e.code
-                elif e.code == 401:
-                    raise DeliciousUnauthorizedError, "Delicious.com error %s - unauthorized (authentication failed?)" % e.code
-                elif e.code == 403:
-                    raise DeliciousForbiddenError, "Delicious.com error %s - forbidden" % e.code
-                elif e.code == 404:
-                    raise DeliciousNotFoundError, "Delicious.com error %s - url not found" % e.code
-                elif e.code == 500:
-                    raise Delicious500Error, "Delicious.com error %s - server problem" % e.code
-                elif e.code == 503 or e.code == 999:
-                    raise DeliciousThrottleError, "Delicious.com error %s - unable to process request (your IP address has been throttled/blocked)" % e.code
+                if self.governor is not None:
+                    self.governor.acquire(governor_key)
+                if self.rate_limiter is not None:
+                    self.rate_limiter.acquire(host)
+                try:
+                    status, msg, body = self._connections.urlopen(url, headers, proxy=proxy, stream=stream)
+                except (httplib.HTTPException, socket.error):
+                    # sometimes we get a "Connection Refused" error
+                    # wait a bit and then try again
+                    outcome = DeliciousProxyPool.FAILED
+                    if self.governor is not None:
+                        self.governor.failed(governor_key)
+                    elif not pooled:
+                        # with a proxy pool, the next try goes through
+                        # another proxy right away
+                        time.sleep(self.wait_seconds)
+                    tries -= 1
+                    continue
+                if status == 503 or status == 999:
+                    outcome = DeliciousProxyPool.THROTTLED
+                    if self.governor is not None:
+                        # back off and try again
+                        self.governor.throttled(governor_key, msg.getheader('retry-after'))
+                    if self.governor is not None or pooled:
+                        # try again (through another proxy, if any)
+                        throttled = status
+                        tries -= 1
+                        continue
                 else:
-                    raise DeliciousUnknownError, "Delicious.com error %s - unknown error" % e.code
+                    outcome = DeliciousProxyPool.OK
+                    if self.governor is not None:
+                        self.governor.success(governor_key)
+            finally:
+                if pooled:
+                    self.proxy_pool.release(proxy, outcome)
+            if 200 <= status < 300:
+                data = body
+                if cacheable:
+                    self.cache.store(host, path, user, data, msg)
                 break
-            except urllib2.URLError, e:
-                time.sleep(self.wait_seconds)
-            except socket.error, msg:
-                # sometimes we get a "Connection Refused" error
-                # wait a bit and then try again
-                time.sleep(self.wait_seconds)
-            #finally:
-            #    f.close()
-            tries -= 1
+            elif status == 304 and cached:
+                data = cached['body']
+                self.cache.revalidated(host, path, user, cached)
+                break
+            elif status in (301, 302, 303, 307) and msg.getheader('location') and redirects < self.max_redirects:
+                # follow redirections like urllib2 does
+                location = urlparse.urljoin(url, msg.getheader('location'))
+                if urlparse.urlsplit(location).netloc != urlparse.urlsplit(url).netloc:
+                    # neither send the credentials nor the validators of
+                    # the cached response to another host
+                    for header in ('Authorization', 'If-None-Match', 'If-Modified-Since'):
+                        headers.pop(header, None)
+                    cached = None
+                url = location
+                redirects += 1
+                continue
+            elif status == 301:
+                raise DeliciousMovedPermanentlyWarning, "Delicious.com status %s - url moved permanently" % status
+            elif status in (302, 303, 307):
+                raise DeliciousMovedTemporarilyWarning, "Delicious.com status %s - url moved temporarily" % status
+            elif status == 401:
+                raise DeliciousUnauthorizedError, "Delicious.com error %s - unauthorized (authentication failed?)" % status
+            elif status == 403:
+                raise DeliciousForbiddenError, "Delicious.com error %s - forbidden" % status
+            elif status == 404:
+                raise DeliciousNotFoundError, "Delicious.com error %s - url not found" % status
+            elif status == 500:
+                raise Delicious500Error, "Delicious.com error %s - server problem" % status
+            elif status == 503 or status == 999:
+                raise DeliciousThrottleError, "Delicious.com error %s - unable to process request (your IP address has been throttled/blocked)" % status
+            else:
+                raise DeliciousUnknownError, "Delicious.com error %s - unknown error" % status
+        if data is None and throttled is not None:
+            raise DeliciousThrottleError, "Delicious.com error %s - unable to process request (your IP address has been throttled/blocked)" % throttled
         return data
 
 
@@ -431,43 +2290,203 @@ class DeliciousAPI(object):
         assert sleep_seconds >= 1
 
         document = DeliciousURL(url)
+        if self._update_urlinfo(document):
+            document.bookmarks = self.get_bookmarks(url=url, max_bookmarks=max_bookmarks, sleep_seconds=sleep_seconds)
+        return document
+
+    def refresh_url(self, document, max_bookmarks=50, sleep_seconds=1):
+        """
+        Updates a DeliciousURL instance with the latest Delicious.com history of its URL.
+
+        This is much cheaper than calling get_url() again. Title, top tags
+        and total number of bookmarks are always updated. If the total
+        number of bookmarks has not changed, the bookmarking history is not
+        retrieved at all. Otherwise, only the newest bookmarks are retrieved
+        until a bookmark already contained in document is reached, and the
+        new bookmarks are merged into document. If more than max_bookmarks
+        bookmarks are new, the bookmarks in between would be missing; the
+        newest max_bookmarks bookmarks then replace those of document, just
+        as if get_url() had been called again. If the history could not be
+        retrieved up to a known bookmark for other reasons (e.g. errors),
+        the bookmarks of document are left as they are, and so is its total
+        number of bookmarks, so that the next refresh tries again.
+
+        @param document: A DeliciousURL instance, typically returned by an
+            earlier call of get_url().
+        @type document: DeliciousURL
+
+        @param max_bookmarks: Optional, default: 50.
+            Maximum number of new bookmarks to retrieve. Set to 0 to
+            retrieve all new bookmarks. See also get_bookmarks().
+        @type max_bookmarks: int
+
+        @param sleep_seconds: Optional, default: 1.
+            See the documentation of get_bookmarks(). sleep_seconds must be
+            >= 1 to comply with Delicious.com's Terms of Use.
+        @type sleep_seconds: int
+
+        @return: The number of new bookmarks added to document (or the
+            number of bookmarks which replaced those of document), 0 if
+            the history could not be retrieved.
+
+        """
+        assert sleep_seconds >= 1
+        old_total_bookmarks = document.total_bookmarks
+        if not self._update_urlinfo(document):
+            return 0
+        if document.total_bookmarks == old_total_bookmarks:
+            return 0
 
+        known = set((user, timestamp) for user, tags, comment, timestamp in document.bookmarks)
+        bookmarks = []
+        # one bookmark more than wanted tells whether exactly max_bookmarks
+        # bookmarks are new or more than that
+        limit = max_bookmarks and max_bookmarks + 1
+        for bookmark in self.iter_bookmarks(url=document.url, max_bookmarks=limit, sleep_seconds=sleep_seconds):
+            user, tags, comment, timestamp = bookmark
+            if (user, timestamp) in known:
+                # bookmarks are sorted newest first, so all further
+                # bookmarks are known already
+                break
+            bookmarks.append(bookmark)
+        else:
+            # no known bookmark has been reached, so the retrieved
+            # bookmarks cannot be joined with the known ones without a gap
+            if max_bookmarks and len(bookmarks) > max_bookmarks:
+                document.bookmarks = bookmarks[:max_bookmarks]
+                return max_bookmarks
+            if bookmarks and len(bookmarks) >= document.total_bookmarks:
+                # the whole history has been retrieved
+                document.bookmarks = bookmarks
+                return len(bookmarks)
+            # the crawl has stopped early, e.g. because of errors
+            document.total_bookmarks = old_total_bookmarks
+            return 0
+        document.add_bookmarks(bookmarks, prepend=True)
+        return len(bookmarks)
+
+    def _update_urlinfo(self, document):
+        """
+        Updates title, top tags and total number of bookmarks of a DeliciousURL instance.
+
+        The information is retrieved from the official urlinfo JSON feed.
+
+        @return: True if the feed could be retrieved, False otherwise.
+
+        """
         m = hashlib.md5()
-        m.update(url)
+        m.update(document.url)
         hash = m.hexdigest()
 
         path = "/v2/json/urlinfo/%s" % hash
         data = self._query(path, host="feeds.delicious.com")
-        if data:
-            urlinfo = {}
-            try:
-                urlinfo = simplejson.loads(data)
-                if urlinfo:
-                    urlinfo = urlinfo[0]
-                else:
-                    urlinfo = {}
-            except TypeError:
-                pass
-            try:
-                document.title = urlinfo['title'] or u""
-            except KeyError:
-                pass
-            try:
-                top_tags = urlinfo['top_tags'] or {}
-                if top_tags:
-                    document.top_tags = sorted(top_tags.iteritems(), key=itemgetter(1), reverse=True)
-                else:
-                    document.top_tags = []
-            except KeyError:
-                pass
-            try:
-                document.total_bookmarks = int(urlinfo['total_posts'])
-            except (KeyError, ValueError):
-                pass
-            document.bookmarks = self.get_bookmarks(url=url, max_bookmarks=max_bookmarks, sleep_seconds=sleep_seconds)
+        if not data:
+            return False
+        urlinfo = {}
+        try:
+            urlinfo = simplejson.loads(data)
+            if urlinfo:
+                urlinfo = urlinfo[0]
+            else:
+                urlinfo = {}
+        except TypeError:
+            pass
+        try:
+            document.title = urlinfo['title'] or u""
+        except KeyError:
+            pass
+        try:
+            top_tags = urlinfo['top_tags'] or {}
+            if top_tags:
+                document.top_tags = sorted(top_tags.iteritems(), key=itemgetter(1), reverse=True)
+            else:
+                document.top_tags = []
+        except KeyError:
+            pass
+        try:
+            document.total_bookmarks = int(urlinfo['total_posts'])
+        except (KeyError, ValueError):
+            pass
+        return True
+
+    def get_urls_info(self, urls, max_bookmarks=50, sleep_seconds=1, max_workers=4, rate=None):
+        """
+        Retrieves the Delicious.com history of many URLs concurrently.
 
+        This is a batch version of get_url(). The URLs are looked up on a
+        bounded pool of worker threads, and the results are yielded in the
+        order in which the lookups complete (which is generally not the
+        order of urls). A failing lookup does not abort the batch; its
+        error is yielded instead.
 
-        return document
+        All queries of the batch are paced by one shared rate limiter, so
+        the total request rate does not grow with max_workers. If this
+        DeliciousAPI instance has a rate_limiter, it is used. Otherwise, a
+        DeliciousRateLimiter for the given rate is used.
+
+        @param urls: The URLs of the web documents to be queried for.
+        @type urls: iterable of str
+
+        @param max_bookmarks: Optional, default: 50.
+            See the documentation of get_url().
+        @type max_bookmarks: int
+
+        @param sleep_seconds: Optional, default: 1.
+            See the documentation of get_url(). Also determines the default
+            rate, see below.
+        @type sleep_seconds: int
+
+        @param max_workers: Optional, default: 4.
+            Maximum number of concurrent lookups. max_workers must be >= 1.
+        @type max_workers: int
+
+        @param rate: Optional, default: None.
+            Maximum number of queries per second for the whole batch.
+            Defaults to one query per sleep_seconds. Ignored if this
+            DeliciousAPI instance has a rate_limiter.
+        @type rate: float
+
+        @return: Generator of (url, document, error) tuples. On success,
+            document is the DeliciousURL instance of url and error is None.
+            On failure, document is None and error is the raised exception.
+
+        """
+        assert sleep_seconds >= 1
+        assert max_workers >= 1
+
+        delicious = self
+        if self.rate_limiter is None:
+            # shallow copy which shares connections and cache with self
+            delicious = copy.copy(self)
+            delicious.rate_limiter = DeliciousRateLimiter(rate or 1.0 / sleep_seconds)
+
+        results = Queue.Queue()
+        pool = ThreadPool(max_workers)
+        pending = 0
+        try:
+            for url in urls:
+                pool.apply_async(delicious._get_url_info, (url, max_bookmarks, sleep_seconds, results))
+                pending += 1
+                # do not queue up more lookups than needed to keep all
+                # workers busy
+                while pending >= 2 * max_workers:
+                    yield results.get()
+                    pending -= 1
+            while pending > 0:
+                yield results.get()
+                pending -= 1
+        finally:
+            # drops any queued lookups if the caller stopped early
+            pool.terminate()
+
+    def _get_url_info(self, url, max_bookmarks, sleep_seconds, results):
+        """Looks up a single URL for get_urls_info() and puts the outcome into results."""
+        try:
+            document = self.get_url(url, max_bookmarks=max_bookmarks, sleep_seconds=sleep_seconds)
+        except Exception, e:
+            results.put( (url, None, e) )
+        else:
+            results.put( (url, document, None) )
 
     def get_network(self, username):
         """
@@ -651,6 +2670,25 @@ class DeliciousAPI(object):
             Bookmarks are sorted "descendingly" by creation time, i.e. newer
             bookmarks come first.
 
+        """
+        return list(self.iter_bookmarks(url=url, username=username, max_bookmarks=max_bookmarks, sleep_seconds=sleep_seconds))
+
+    def iter_bookmarks(self, url=None, username=None, max_bookmarks=50, sleep_seconds=1):
+        """
+        Yields the bookmarks of url or user, respectively, page by page.
+
+        This is the streaming version of get_bookmarks(). The bookmarks of a
+        result page are yielded as soon as the page has been retrieved and
+        parsed, so processing can start before the whole bookmarking history
+        has been crawled. The next page is only retrieved once the caller
+        asks for more bookmarks; i.e. the caller can stop the crawl at any
+        time simply by not iterating any further.
+
+        See get_bookmarks() for a description of the parameters and of the
+        yielded bookmark tuples.
+
+        @return: Generator of bookmark tuples, newer bookmarks first.
+
         """
         # we must wait at least 1 second between subsequent queries to
         # comply with delicious' Terms of Use
@@ -662,13 +2700,9 @@ class DeliciousAPI(object):
         # maximum number of urls/posts Delicious.com will display
         # per page on its website
         max_html_count = 100
-        # maximum number of pages that Delicious.com will display;
-        # currently, the maximum number of pages is 20. Delicious.com
-        # allows to go beyond page 20 via pagination, but page N (for
-        # N > 20) will always display the same content as page 20.
-        max_html_pages = 20
 
         path = None
+        path_suffix = ""
         if url:
             m = hashlib.md5()
             m.update(url)
@@ -677,50 +2711,364 @@ class DeliciousAPI(object):
             # path will change later on if there are multiple pages of boomarks
             # for the given url
             path = "/url/%s" % hash
+            kind = "url"
         elif username:
             # path will change later on if there are multiple pages of boomarks
             # for the given username
             path = "/%s?setcount=%d" % (username, max_html_count)
+            path_suffix = "&setcount=%d" % max_html_count
+            kind = "user"
         else:
             raise Exception('You must specify either url or user.')
 
-        page_index = 1
-        bookmarks = []
+        count = 0
+        for page_bookmarks in self._iter_pages(path, kind, sleep_seconds, max_bookmarks, path_suffix):
+            for bookmark in page_bookmarks:
+                yield bookmark
+                count += 1
+                # stop scraping if we already have as many bookmarks as we want
+                if count == max_bookmarks:
+                    return
+
+    def _iter_pages(self, path, kind, sleep_seconds, max_records=0, path_suffix="", unique=False):
+        """
+        Yields the records of a paginated result, page by page.
+
+        Starting at path, the pagination of Delicious.com is followed until
+        there is no next page, a page has no records or max_records records
+        have been retrieved. The next page is retrieved only when the caller
+        asks for it.
+
+        The pagination is not followed any further either if a page does
+        not add any records which have not been retrieved before, e.g. if it
+        is identical to a previous page (Delicious.com displays the content
+        of page 20 for all pages beyond 20). Such a page is not yielded.
+
+        If this instance has been set up with prefetch_pages, several pages
+        are retrieved concurrently. Otherwise, if it has been set up with
+        parse_processes, pages are parsed by a pool of worker processes
+        while the following pages are retrieved.
+
+        @param path: The path of the first result page.
+        @type path: str
+
+        @param kind: The kind of result page (see _parse_page()).
+        @type kind: str
+
+        @param sleep_seconds: Wait the specified number of seconds between
+            subsequent queries.
+        @type sleep_seconds: int
+
+        @param max_records: Optional, default: 0.
+            Do not follow the pagination any further once this many records
+            have been retrieved. Set to 0 to disable the limit.
+        @type max_records: int
+
+        @param path_suffix: Optional, default: "".
+            Query string parameters to append to the paths of next pages.
+        @type path_suffix: str
+
+        @param unique: Optional, default: False.
+            Drop records which have been yielded before (in order of
+            appearance), so that max_records counts unique records.
+        @type unique: bool
+
+        @return: Generator of lists of records (see _parse_page()).
+
+        """
+        # maximum number of pages that Delicious.com will display;
+        # currently, the maximum number of pages is 20. Delicious.com
+        # allows to go beyond page 20 via pagination, but page N (for
+        # N > 20) will always display the same content as page 20.
+        max_html_pages = 20
+
+        # with unique records, the number of records per page does not tell
+        # when to stop; this is decided below instead
+        page_max_records = max_records
+        if unique:
+            page_max_records = 0
+
+        if self._prefetch_pool is not None:
+            pages = self._iter_pages_prefetched(path, kind, sleep_seconds, page_max_records, path_suffix, max_html_pages)
+        elif self._parse_pool is not None:
+            pages = self._iter_pages_in_processes(path, kind, sleep_seconds, page_max_records, path_suffix, max_html_pages)
+        else:
+            pages = self._iter_pages_sequentially(path, kind, sleep_seconds, page_max_records, path_suffix, max_html_pages)
+
+        seen = set()
+        fingerprints = set()
+        count = 0
+        for records in pages:
+            keys = [_record_key(record) for record in records]
+            fingerprint = hashlib.md5(repr(keys)).digest()
+            if fingerprint in fingerprints:
+                # the same page again
+                return
+            fingerprints.add(fingerprint)
+
+            page_records = []
+            added = 0
+            for record, key in zip(records, keys):
+                if key in seen:
+                    if not unique:
+                        page_records.append(record)
+                    continue
+                seen.add(key)
+                added += 1
+                page_records.append(record)
+            if records and added == 0:
+                # nothing new on this page, nor (most likely) on the
+                # following ones
+                return
+
+            yield page_records
+            count += len(page_records)
+            if unique and max_records > 0 and count >= max_records:
+                return
+
+    def _iter_pages_sequentially(self, path, kind, sleep_seconds, max_records, path_suffix, max_html_pages, page_index=1, count=0):
+        """
+        Variant of _iter_pages() which retrieves and parses one page after the other.
+
+        page_index and count are the number of the page at path and the
+        number of records retrieved before it, respectively.
+
+        """
         while path and page_index <= max_html_pages:
             data = self._query(path)
             path = None
             if data:
-                # extract bookmarks from current page
-                if url:
-                    bookmarks.extend(self._extract_bookmarks_from_url_history(data))
-                else:
-                    bookmarks.extend(self._extract_bookmarks_from_user_history(data))
+                # extract records and the link to the next page (if there
+                # are multiple pages of records on Delicious.com) from
+                # current page
+                records, next_path = self._parse_page(data, kind)
+                count += len(records)
+                yield records
+
+                if next_path and count > 0 and (max_records <= 0 or count < max_records):
+                    # e.g. /url/2bb293d594a93e77d45c2caaf120e1b1?show=all&page=2
+                    path = next_path + path_suffix
+                    page_index += 1
+                    # wait one second between queries to be compliant with
+                    # delicious' Terms of Use
+                    time.sleep(sleep_seconds)
+
+    def _iter_pages_prefetched(self, path, kind, sleep_seconds, max_records, path_suffix, max_html_pages):
+        """
+        Variant of _iter_pages() which retrieves several pages concurrently.
 
-                # stop scraping if we already have as many bookmarks as we want
-                if (len(bookmarks) >= max_bookmarks) and max_bookmarks != 0:
-                    break
-                else:
-                    # check if there are multiple pages of bookmarks for this
-                    # url on Delicious.com
-                    soup = BeautifulSoup(data)
-                    paginations = soup.findAll("div", id="pagination")
-                    if paginations:
-                        # find next path
-                        nexts = paginations[0].findAll("a", attrs={ "class": "pn next" })
-                        if nexts and (max_bookmarks == 0 or len(bookmarks) < max_bookmarks) and len(bookmarks) > 0:
-                            # e.g. /url/2bb293d594a93e77d45c2caaf120e1b1?show=all&page=2
-                            path = nexts[0]['href']
-                            if username:
-                                path += "&setcount=%d" % max_html_count
-                            page_index += 1
-                            # wait one second between queries to be compliant with
-                            # delicious' Terms of Use
-                            time.sleep(sleep_seconds)
-        if max_bookmarks > 0:
-            return bookmarks[:max_bookmarks]
+        The first page is retrieved on its own. Its link to page 2 serves
+        as the template for the paths of all following pages, which are
+        retrieved up to prefetch_pages at a time. Each page is only used if
+        its path matches the link to it on the previous page. On a mismatch,
+        the prefetched pages are discarded and the paths of the following
+        pages are predicted from the actual link; if that is not possible,
+        the remaining pages are retrieved by following the pagination as
+        usual. Records are yielded in page order.
+
+        """
+        delicious = self
+        if self.rate_limiter is None:
+            # shallow copy which shares connections and cache with self;
+            # the first page goes through its rate limiter, too, so that
+            # the second page is not retrieved right after it
+            delicious = copy.copy(self)
+            delicious.rate_limiter = DeliciousRateLimiter(1.0 / sleep_seconds)
+
+        data = delicious._query(path)
+        if not data:
+            return
+        records, next_path = self._parse_page(data, kind)
+        count = len(records)
+        yield records
+        if not next_path or count == 0 or (max_records > 0 and count >= max_records):
+            return
+
+        page_index = 2
+        expected_path = next_path + path_suffix
+        match = _page_number.search(expected_path)
+        if match is None or match.group(1) != "2":
+            # unknown pagination scheme
+            time.sleep(sleep_seconds)
+            for records in self._iter_pages_sequentially(expected_path, kind, sleep_seconds, max_records, path_suffix, max_html_pages, page_index, count):
+                yield records
+            return
+
+        prefix, suffix = expected_path[:match.start(1)], expected_path[match.end(1):]
+
+        def make_path(page):
+            return "%s%d%s" % (prefix, page, suffix)
+
+        last_page = max_html_pages
+        if max_records > 0:
+            # assume that all pages hold as many records as the first one
+            last_page = min(last_page, 1 + int(math.ceil((max_records - count) / float(count))))
+
+        pending = {}
+        while page_index <= last_page:
+            if make_path(page_index) != expected_path:
+                # the pagination does not follow the predicted paths (any
+                # more); pages which have been retrieved for the predicted
+                # paths are discarded
+                match = _page_number.search(expected_path)
+                if match is None or match.group(1) != str(page_index):
+                    time.sleep(sleep_seconds)
+                    for records in self._iter_pages_sequentially(expected_path, kind, sleep_seconds, max_records, path_suffix, max_html_pages, page_index, count):
+                        yield records
+                    return
+                # predict the following pages from the actual link instead
+                prefix, suffix = expected_path[:match.start(1)], expected_path[match.end(1):]
+                pending = {}
+            for page in range(page_index, min(last_page, page_index + self.prefetch_pages - 1) + 1):
+                if page not in pending:
+                    pending[page] = self._prefetch_pool.apply_async(delicious._query, (make_path(page),))
+            data = pending.pop(page_index).get()
+            if not data:
+                return
+            records, next_path = self._parse_page(data, kind)
+            count += len(records)
+            yield records
+            if not next_path or not records or (max_records > 0 and count >= max_records):
+                return
+            expected_path = next_path + path_suffix
+            page_index += 1
+
+    def _iter_pages_in_processes(self, path, kind, sleep_seconds, max_records, path_suffix, max_html_pages):
+        """
+        Variant of _iter_pages() which overlaps parsing with retrieving pages.
+
+        The HTML source of each page is handed to the parse pool, and only
+        the link to the next page is extracted in this process (which is
+        much cheaper than a full parse). Records are yielded in page order.
+
+        If the decision whether to follow the pagination depends on records
+        which are still being parsed, the parse results are waited for
+        first, so that no more pages are retrieved than in sequential mode.
+
+        """
+        # upper bound of the number of records on one page
+        max_html_count = 100
+
+        # parse results of retrieved pages, in page order
+        pending = collections.deque()
+        page_index = 1
+        count = 0
+        while path and page_index <= max_html_pages:
+            data = self._query(path)
+            path = None
+            if not data:
+                break
+            pending.append(self._parse_pool.apply_async(_parse_page_in_process, (data, kind, self.parser)))
+            next_path = _scan_next_path(data)
+
+            # hand out pages which have already been parsed
+            while pending and pending[0].ready():
+                records = pending.popleft().get()[0]
+                count += len(records)
+                yield records
+            if not next_path:
+                break
+            if pending and (count == 0 or (max_records > 0 and count + len(pending) * max_html_count >= max_records)):
+                # we cannot decide yet whether to retrieve the next page
+                while pending:
+                    records = pending.popleft().get()[0]
+                    count += len(records)
+                    yield records
+            if count == 0 or (max_records > 0 and count >= max_records):
+                break
+
+            path = next_path + path_suffix
+            page_index += 1
+            # wait one second between queries to be compliant with
+            # delicious' Terms of Use
+            time.sleep(sleep_seconds)
+
+        while pending:
+            yield pending.popleft().get()[0]
+
+    def _parse_page(self, data, kind):
+        """
+        Extracts the records and the link to the next page from a result page.
+
+        The HTML page is parsed only once, no matter how much information is
+        extracted from it, using the parser backend of this instance.
+
+        @param data: The HTML source of a result page on Delicious.com.
+        @type data: str
+
+        @param kind: The kind of result page: "url" for a URL's history page,
+            "user" for a user page and "tag" for a /tag/<tag> or
+            /popular/<tag> page.
+        @type kind: str
+
+        @return: Tuple of (records, next_path), where records is the list of
+            bookmarks (for "url" and "user" pages) or URLs (for "tag" pages)
+            and next_path is the path of the next result page or None if
+            there is no next page.
+
+        """
+        if self.parser == "htmlparser":
+            try:
+                return _parse_page_fast(data, kind)
+            except HTMLParser.HTMLParseError:
+                # fall back to the more forgiving BeautifulSoup
+                pass
+        soup = BeautifulSoup(data)
+        if kind == "url":
+            records = self._extract_bookmarks_from_url_history(soup)
+        elif kind == "user":
+            records = self._extract_bookmarks_from_user_history(soup)
         else:
-            return bookmarks
+            records = self._extract_urls_from_tag_page(soup)
+        return records, self._extract_next_path(soup)
+
+    def _extract_next_path(self, data):
+        """
+        Extracts the path of the next result page from a paginated Delicious.com page.
+
+        @param data: The HTML source of a result page on Delicious.com or
+            its already parsed BeautifulSoup instance.
+        @type data: str or BeautifulSoup
+
+        @return: The path of the next result page or None if there is none.
 
+        """
+        soup = self._make_soup(data)
+        paginations = soup.findAll("div", id="pagination")
+        if paginations:
+            nexts = paginations[0].findAll("a", attrs={ "class": "pn next" })
+            if nexts:
+                return nexts[0]['href']
+        return None
+
+    def _extract_urls_from_tag_page(self, data):
+        """
+        Extracts the URLs from a /tag/<tag> or /popular/<tag> page on Delicious.com.
+
+        @param data: The HTML source of the page or its already parsed
+            BeautifulSoup instance.
+        @type data: str or BeautifulSoup
+
+        @return: list of URLs
+
+        """
+        urls = []
+        soup = self._make_soup(data)
+        links = soup.findAll("a", attrs={"class": re.compile("^taggedlink\s*")})
+        for link in links:
+            try:
+                url = link['href']
+            except KeyError:
+                continue
+            if url:
+                urls.append(url)
+        return urls
+
+    def _make_soup(self, data):
+        """Returns data as BeautifulSoup instance, parsing it only if needed."""
+        if isinstance(data, BeautifulSoup):
+            return data
+        return BeautifulSoup(data)
 
     def _extract_bookmarks_from_url_history(self, data):
         """
@@ -729,13 +3077,14 @@ class DeliciousAPI(object):
         The Python library BeautifulSoup is used to parse the HTML page.
 
         @param data: The HTML source of a URL history Web page on Delicious.com.
-        @type data: str
+            or its already parsed BeautifulSoup instance.
+        @type data: str or BeautifulSoup
 
         @return: list of user bookmarks of the corresponding URL
 
         """
         bookmarks = []
-        soup = BeautifulSoup(data)
+        soup = self._make_soup(data)
 
         bookmark_elements = soup.findAll("div", attrs={"class": re.compile("^bookmark\s*")})
         timestamp = None
@@ -786,7 +3135,7 @@ class DeliciousAPI(object):
                         # this problem of Delicious is very rare, so we just skip such
                         # entries until they find a fix
                         pass
-                    bookmarks.append( (user, user_tags, comment, timestamp) )
+                    bookmarks.append(DeliciousURLBookmark(user, user_tags, comment, timestamp))
 
         return bookmarks
 
@@ -797,13 +3146,14 @@ class DeliciousAPI(object):
         The Python library BeautifulSoup is used to parse the HTML page.
 
         @param data: The HTML source of a user page on Delicious.com.
-        @type data: str
+            or its already parsed BeautifulSoup instance.
+        @type data: str or BeautifulSoup
 
         @return: list of bookmarks of the corresponding user
 
         """
         bookmarks = []
-        soup = BeautifulSoup(data)
+        soup = self._make_soup(data)
 
         ul = soup.find("ul", id="bookmarklist")
         if ul:
@@ -846,12 +3196,12 @@ class DeliciousAPI(object):
                         tag = a.contents[0]
                         url_tags.append(tag)
 
-                bookmarks.append( (url, url_tags, title, comment, timestamp) )
+                bookmarks.append(DeliciousUserBookmark(url, url_tags, title, comment, timestamp))
 
         return bookmarks
 
 
-    def get_user(self, username, password=None, max_bookmarks=50, sleep_seconds=1):
+    def get_user(self, username, password=None, max_bookmarks=50, sleep_seconds=1, since=None):
         """Retrieves a user's bookmarks from Delicious.com.
 
         If a correct username AND password are supplied, a user's *full*
@@ -890,29 +3240,40 @@ class DeliciousAPI(object):
             Terms of Use.
         @type sleep_seconds: int
 
-        @return: DeliciousUser instance
+        @param since: Optional, default: None.
+            Only retrieve the bookmarks which have been added since the
+            last synchronization (e.g. to refresh a mirror of a user's
+            bookmarks). Either the DeliciousUser instance of a previous
+            call of get_user() -- which gives the most accurate results --
+            or the creation time of the newest bookmark known so far.
+
+            Because bookmarks are retrieved newest first, the retrieval
+            stops as soon as a known bookmark is reached. If a password is
+            specified, the time of the user's last update as reported by
+            the official Delicious.com API is checked first, and the full
+            bookmark collection is only downloaded if it has changed.
+        @type since: DeliciousUser or datetime.datetime
+
+        @return: DeliciousUser instance. If since is set, it contains only
+            the bookmarks added since then, newer bookmarks first.
 
         """
         assert username
         user = DeliciousUser(username)
         bookmarks = []
+        since_time, known_urls = self._get_sync_state(since)
         if password:
             # We have username AND password, so we call
             # the official Delicious.com API.
-            path = "/v1/posts/all"
-            data = self._query(path, host="api.del.icio.us", use_ssl=True, user=username, password=password)
-            if data:
-                soup = BeautifulSoup(data)
-                elements = soup.findAll("post")
-                for element in elements:
-                    url = element["href"]
-                    title = element["description"] or u""
-                    comment = element["extended"] or u""
-                    tags = []
-                    if element["tag"]:
-                        tags = element["tag"].split()
-                    timestamp = datetime.datetime.strptime(element["time"], "%Y-%m-%dT%H:%M:%SZ")
-                    bookmarks.append( (url, tags, title, comment, timestamp) )
+            if since_time is not None:
+                # the API asks clients to check for updates before
+                # downloading all posts
+                last_update = self._get_last_update(username, password)
+                if last_update is not None and last_update <= since_time:
+                    return user
+            for bookmark in self.iter_posts(username, password):
+                if not self._is_known(bookmark, since_time, known_urls):
+                    bookmarks.append(bookmark)
             user.bookmarks = bookmarks
         else:
             # We have only the username, so we extract data from
@@ -962,14 +3323,160 @@ class DeliciousAPI(object):
                             timestamp = datetime.datetime.strptime(post['dt'], "%Y-%m-%dT%H:%M:%SZ")
                         except KeyError:
                             pass
-                        bookmarks.append( (url, tags, title, comment, timestamp) )
+                        bookmark = DeliciousUserBookmark(url, tags, title, comment, timestamp)
+                        if self._is_known(bookmark, since_time, known_urls):
+                            # the feed is sorted newest first
+                            break
+                        bookmarks.append(bookmark)
                     user.bookmarks = bookmarks[:max_bookmarks]
             else:
                 # TODO: retrieve the first 100 bookmarks via JSON before
                 #       falling back to scraping the delicous.com website
-                user.bookmarks = self.get_bookmarks(username=username, max_bookmarks=max_bookmarks, sleep_seconds=sleep_seconds)
+                for bookmark in self.iter_bookmarks(username=username, max_bookmarks=max_bookmarks, sleep_seconds=sleep_seconds):
+                    if self._is_known(bookmark, since_time, known_urls):
+                        # stop following the pagination, all further
+                        # bookmarks are older
+                        break
+                    bookmarks.append(bookmark)
+                user.bookmarks = bookmarks
         return user
 
+    def iter_posts(self, username, password, backup_file=None):
+        """Yields a user's full bookmark collection from the official Delicious.com API.
+
+        The bookmarks are parsed incrementally while the collection
+        (/v1/posts/all) is downloaded, so memory usage does not depend on
+        the size of the collection. Data communication is encrypted using
+        SSL.
+
+        @param username: The Delicious.com username.
+        @type username: str
+
+        @param password: The user's Delicious.com password.
+        @type password: unicode/str
+
+        @param backup_file: Optional, default: None.
+            Write the downloaded XML document unchanged to this file (a file
+            name or a file object opened for binary writing) while parsing.
+        @type backup_file: str or file
+
+        @return: Generator of (url, tags, title, comment, timestamp) tuples
+            (see DeliciousUserBookmark), newer bookmarks first.
+
+        """
+        assert username and password
+        stream = self._query("/v1/posts/all", host="api.del.icio.us", use_ssl=True, user=username, password=password, stream=True)
+        if stream is None:
+            return
+        opened_file = None
+        try:
+            source = stream
+            if backup_file is not None:
+                if isinstance(backup_file, basestring):
+                    backup_file = opened_file = open(backup_file, 'wb')
+                source = _TeeReader(stream, backup_file)
+            root = None
+            for event, element in ElementTree.iterparse(source, events=("start", "end")):
+                if root is None:
+                    root = element
+                if event == "end" and element.tag == "post":
+                    yield self._make_post_bookmark(element.attrib)
+                    # drop parsed posts so that memory usage stays constant
+                    root.clear()
+        finally:
+            stream.close()
+            if opened_file is not None:
+                opened_file.close()
+
+    def _make_post_bookmark(self, attrs):
+        """Returns a DeliciousUserBookmark for the attributes of a <post> element of the official API."""
+        url = unicode(attrs.get("href", u""))
+        title = unicode(attrs.get("description") or u"")
+        comment = unicode(attrs.get("extended") or u"")
+        tags = []
+        if attrs.get("tag"):
+            tags = unicode(attrs["tag"]).split()
+        timestamp = None
+        if attrs.get("time"):
+            timestamp = datetime.datetime.strptime(attrs["time"], "%Y-%m-%dT%H:%M:%SZ")
+        return DeliciousUserBookmark(url, tags, title, comment, timestamp)
+
+    def backup_user(self, username, password, filename):
+        """Downloads a user's full bookmark collection straight to a file.
+
+        The file contains the XML document of the official Delicious.com
+        API (/v1/posts/all) as-is. The document is written while it is
+        downloaded, so memory usage does not depend on the size of the
+        collection.
+
+        @param username: The Delicious.com username.
+        @type username: str
+
+        @param password: The user's Delicious.com password.
+        @type password: unicode/str
+
+        @param filename: The name of the backup file.
+        @type filename: str
+
+        @return: The number of backed up bookmarks.
+
+        """
+        count = 0
+        for bookmark in self.iter_posts(username, password, backup_file=filename):
+            count += 1
+        return count
+
+    def _get_sync_state(self, since):
+        """Returns a (since_time, known_urls) tuple for the since parameter of get_user().
+
+        since_time is the creation time of the newest known bookmark (or
+        None if all bookmarks are new), and known_urls is the set of URLs
+        of the known bookmarks created at since_time.
+
+        """
+        if since is None:
+            return None, set()
+        if isinstance(since, datetime.datetime):
+            return since, set()
+        timestamps = [timestamp for url, tags, title, comment, timestamp in since.bookmarks if timestamp is not None]
+        if not timestamps:
+            return None, set()
+        since_time = max(timestamps)
+        known_urls = set(url for url, tags, title, comment, timestamp in since.bookmarks if timestamp == since_time)
+        return since_time, known_urls
+
+    def _is_known(self, bookmark, since_time, known_urls):
+        """Returns True if the bookmark is not newer than the sync state of get_user()."""
+        if since_time is None:
+            return False
+        url, tags, title, comment, timestamp = bookmark
+        if url in known_urls:
+            return True
+        if timestamp is None:
+            return False
+        if timestamp == since_time:
+            # without a list of known urls, we cannot tell whether the
+            # bookmark is the known one or a newer one of the same time
+            return not known_urls
+        return timestamp < since_time
+
+    def _get_last_update(self, username, password):
+        """Returns the time of the user's last update according to the official Delicious.com API.
+
+        @return: datetime.datetime instance or None if unknown.
+
+        """
+        data = self._query("/v1/posts/update", host="api.del.icio.us", use_ssl=True, user=username, password=password)
+        if data:
+            soup = BeautifulSoup(data)
+            update = soup.find("update")
+            if update is not None:
+                try:
+                    return datetime.datetime.strptime(update["time"], "%Y-%m-%dT%H:%M:%SZ")
+                except (KeyError, ValueError):
+                    pass
+        return None
+
     def get_urls(self, tag=None, popular=True, max_urls=100, sleep_seconds=1):
         """
         Returns the list of recent URLs (of web documents) tagged with a given tag.
@@ -1002,19 +3509,20 @@ class DeliciousAPI(object):
             So if you are interested in more URLs, set the "popular" parameter
             to false.
 
-            Note that if you set popular to False, the returned list of URLs
-            might contain duplicate items. This is due to the way Delicious.com
-            creates its /tag/<tag> Web pages. So if you need a certain
-            number of unique URLs, you have to take care of that in your
-            own code.
+            Note that if you set popular to False, Delicious.com returns
+            many duplicate items (this is due to the way Delicious.com
+            creates its /tag/<tag> Web pages). Duplicates are removed, so
+            the returned list contains every URL only once, in the order
+            of its first appearance.
         @type popular: bool
 
-        @param max_urls: Retrieve at most max_urls links. The default is 100,
-            which is the maximum number of links that can be retrieved by
-            parsing the official JSON feeds. The maximum value of max_urls
-            in practice is 2000 (currently). If it is set higher, Delicious
-            will return the same links over and over again, giving lots of
-            duplicate items.
+        @param max_urls: Retrieve at most max_urls unique links. The default
+            is 100, which is the maximum number of links that can be
+            retrieved by parsing the official JSON feeds. The maximum value
+            of max_urls in practice is 2000 (currently). If it is set higher,
+            Delicious will return the same links over and over again; the
+            pagination is then not followed any further once a page does
+            not contain any new links.
         @type max_urls: int
 
         @param sleep_seconds: Optional, default: 1.
@@ -1027,9 +3535,24 @@ class DeliciousAPI(object):
 
         @return: The list of recent URLs (of web documents) tagged with a given tag.
 
+        """
+        return list(self.iter_urls(tag=tag, popular=popular, max_urls=max_urls, sleep_seconds=sleep_seconds))
+
+    def iter_urls(self, tag=None, popular=True, max_urls=100, sleep_seconds=1):
+        """
+        Yields the recent URLs (of web documents) tagged with a given tag.
+
+        This is the streaming version of get_urls(). URLs are yielded page by
+        page as soon as they have been retrieved, and further pages are only
+        retrieved once the caller asks for more URLs.
+
+        See get_urls() for a description of the parameters.
+
+        @return: Generator of URLs, newest items first.
+
         """
         assert sleep_seconds >= 1
-        urls = []
+        count = 0
         path = None
         if tag is None or (tag is not None and max_urls > 0 and max_urls <= 100):
             # use official JSON feeds
@@ -1044,6 +3567,7 @@ class DeliciousAPI(object):
                 # Delicious.com hotlist
                 path = "/v2/json/?count=%d" % (max_json_count)
             data = self._query(path, host="feeds.delicious.com")
+            seen = set()
             if data:
                 posts = []
                 try:
@@ -1055,60 +3579,31 @@ class DeliciousAPI(object):
                     # url
                     try:
                         url = post['u']
-                        if url:
-                            urls.append(url)
                     except KeyError:
-                        pass
+                        continue
+                    if url and url not in seen:
+                        seen.add(url)
+                        yield url
+                        count += 1
+                        if count == max_urls:
+                            return
         else:
             # maximum number of urls/posts Delicious.com will display
             # per page on its website
             max_html_count = 100
-            # maximum number of pages that Delicious.com will display;
-            # currently, the maximum number of pages is 20. Delicious.com
-            # allows to go beyond page 20 via pagination, but page N (for
-            # N > 20) will always display the same content as page 20.
-            max_html_pages = 20
 
             if popular:
                 path = "/popular/%s?setcount=%d" % (tag, max_html_count)
             else:
                 path = "/tag/%s?setcount=%d" % (tag, max_html_count)
 
-            page_index = 1
-            urls = []
-            while path and page_index <= max_html_pages:
-                data = self._query(path)
-                path = None
-                if data:
-                    # extract urls from current page
-                    soup = BeautifulSoup(data)
-                    links = soup.findAll("a", attrs={"class": re.compile("^taggedlink\s*")})
-                    for link in links:
-                        try:
-                            url = link['href']
-                            if url:
-                                urls.append(url)
-                        except KeyError:
-                            pass
-
-                    # check if there are more multiple pages of urls
-                    soup = BeautifulSoup(data)
-                    paginations = soup.findAll("div", id="pagination")
-                    if paginations:
-                        # find next path
-                        nexts = paginations[0].findAll("a", attrs={ "class": "pn next" })
-                        if nexts and (max_urls == 0 or len(urls) < max_urls) and len(urls) > 0:
-                            # e.g. /url/2bb293d594a93e77d45c2caaf120e1b1?show=all&page=2
-                            path = nexts[0]['href']
-                            path += "&setcount=%d" % max_html_count
-                            page_index += 1
-                            # wait between queries to Delicious.com to be
-                            # compliant with its Terms of Use
-                            time.sleep(sleep_seconds)
-        if max_urls > 0:
-            return urls[:max_urls]
-        else:
-            return urls
+            path_suffix = "&setcount=%d" % max_html_count
+            for page_urls in self._iter_pages(path, "tag", sleep_seconds, max_urls, path_suffix, unique=True):
+                for url in page_urls:
+                    yield url
+                    count += 1
+                    if count == max_urls:
+                        return
 
 
     def get_tags_of_user(self, username):
@@ -1174,6 +3669,115 @@ class DeliciousAPI(object):
         return s
 
 
+class AsyncDeliciousAPI(object):
+    """
+    Non-blocking counterpart of DeliciousAPI.
+
+    Each public query method of DeliciousAPI is mirrored by a method of the
+    same name and signature which returns immediately. The query is run on
+    a pool of worker threads, and the method returns an AsyncResult whose
+    get() method waits for and returns the result of the query (or raises
+    the same Delicious*Error that DeliciousAPI would have raised). This
+    allows a single process to keep many queries in flight.
+
+    All workers share one rate limiter, so the total request rate does not
+    grow with max_workers: the rate_limiter of the DeliciousAPI instance if
+    it has one, otherwise a DeliciousRateLimiter for the given rate. Pacing
+    only blocks the worker thread running a query, not the caller.
+
+    Example:
+
+        api = AsyncDeliciousAPI(max_workers=20)
+        results = [api.get_url(url) for url in urls]
+        documents = [result.get() for result in results]
+
+    """
+
+    def __init__(self, max_workers=10, delicious=None, rate=1.0, **kwargs):
+        """Set up the asynchronous API module.
+
+        @param max_workers: Optional, default: 10.
+            Maximum number of queries that run concurrently.
+            max_workers must be >= 1.
+        @type max_workers: int
+
+        @param delicious: Optional, default: None.
+            The DeliciousAPI instance used to run the queries. If not set,
+            a new DeliciousAPI instance is created from the remaining
+            keyword arguments (see DeliciousAPI.__init__()).
+        @type delicious: DeliciousAPI
+
+        @param rate: Optional, default: 1.0.
+            Maximum number of queries per second of all workers together.
+            Ignored if the DeliciousAPI instance has a rate_limiter.
+            rate must be > 0.
+        @type rate: float
+
+        """
+        assert max_workers >= 1
+        assert rate > 0
+        self.max_workers = max_workers
+        # only a DeliciousAPI instance created here is closed by close()
+        self._owns_delicious = delicious is None
+        if delicious is None:
+            if kwargs.get('rate_limiter') is None:
+                kwargs['rate_limiter'] = DeliciousRateLimiter(rate)
+            delicious = DeliciousAPI(**kwargs)
+        elif delicious.rate_limiter is None:
+            # shallow copy which shares connections and cache with delicious
+            delicious = copy.copy(delicious)
+            delicious.rate_limiter = DeliciousRateLimiter(rate)
+        self.delicious = delicious
+        self._pool = ThreadPool(max_workers)
+
+    def _submit(self, method, *args, **kwargs):
+        return self._pool.apply_async(method, args, kwargs)
+
+    def close(self):
+        """Waits for all pending queries to finish and releases the worker threads.
+
+        The DeliciousAPI instance is closed as well, unless it has been
+        passed in by the caller.
+
+        """
+        self._pool.close()
+        self._pool.join()
+        if self._owns_delicious:
+            self.delicious.close()
+
+    def get_url(self, url, max_bookmarks=50, sleep_seconds=1):
+        """Asynchronous version of DeliciousAPI.get_url()."""
+        return self._submit(self.delicious.get_url, url, max_bookmarks=max_bookmarks, sleep_seconds=sleep_seconds)
+
+    def refresh_url(self, document, max_bookmarks=50, sleep_seconds=1):
+        """Asynchronous version of DeliciousAPI.refresh_url()."""
+        return self._submit(self.delicious.refresh_url, document, max_bookmarks=max_bookmarks, sleep_seconds=sleep_seconds)
+
+    def get_network(self, username):
+        """Asynchronous version of DeliciousAPI.get_network()."""
+        return self._submit(self.delicious.get_network, username)
+
+    def get_bookmarks(self, url=None, username=None, max_bookmarks=50, sleep_seconds=1):
+        """Asynchronous version of DeliciousAPI.get_bookmarks()."""
+        return self._submit(self.delicious.get_bookmarks, url=url, username=username, max_bookmarks=max_bookmarks, sleep_seconds=sleep_seconds)
+
+    def get_user(self, username, password=None, max_bookmarks=50, sleep_seconds=1, since=None):
+        """Asynchronous version of DeliciousAPI.get_user()."""
+        return self._submit(self.delicious.get_user, username, password=password, max_bookmarks=max_bookmarks, sleep_seconds=sleep_seconds, since=since)
+
+    def get_urls(self, tag=None, popular=True, max_urls=100, sleep_seconds=1):
+        """Asynchronous version of DeliciousAPI.get_urls()."""
+        return self._submit(self.delicious.get_urls, tag=tag, popular=popular, max_urls=max_urls, sleep_seconds=sleep_seconds)
+
+    def get_tags_of_user(self, username):
+        """Asynchronous version of DeliciousAPI.get_tags_of_user()."""
+        return self._submit(self.delicious.get_tags_of_user, username)
+
+    def backup_user(self, username, password, filename):
+        """Asynchronous version of DeliciousAPI.backup_user()."""
+        return self._submit(self.delicious.backup_user, username, password, filename)
+
+
 class DeliciousError(Exception):
     """Used to indicate that an error occurred when trying to access Delicious.com via its API."""
 
@@ -1234,7 +3838,7 @@ class DeliciousMovedTemporarilyWarning(DeliciousWarning):
     """Used to indicate that Delicious.com returned a 302 Found (Moved Temporarily) redirection."""
     pass
 
-__all__ = ['DeliciousAPI', 'DeliciousURL', 'DeliciousError', 'DeliciousThrottleError', 'DeliciousUnauthorizedError', 'DeliciousUnknownError', 'DeliciousNotFoundError' , 'Delicious500Error', 'DeliciousMovedTemporarilyWarning']
+__all__ = ['DeliciousAPI', 'AsyncDeliciousAPI', 'DeliciousURL', 'DeliciousUser', 'DeliciousURLBookmark', 'DeliciousUserBookmark', 'DeliciousCorpus', 'DeliciousResponseCache', 'DeliciousRateLimiter', 'DeliciousThrottleGovernor', 'DeliciousProxyPool', 'DeliciousError', 'DeliciousThrottleError', 'DeliciousUnauthorizedError', 'DeliciousUnknownError', 'DeliciousNotFoundError' , 'Delicious500Error', 'DeliciousMovedTemporarilyWarning']
 
 if __name__ == "__main__":
     d = DeliciousAPI()
@@ -4,11 +4,20 @@
     (c) 2006-2008 Michael G. Noll <http://www.michael-noll.com/>
     
 """
-import codecs
+import cgi
 import datetime
+import functools
+import gzip
+import hashlib
+import heapq
+import math
 import os
+import re
+import shutil
+import struct
 import sys
 import time
+import urlparse
 
 try:
     import deliciousapi
@@ -19,6 +28,16 @@ except:
     print "http://pypi.python.org/pypi/DeliciousAPI"
     print
 
+try:
+    import simplejson
+except:
+    print "ERROR: could not import simplejson module"
+    print
+    print "You can download simplejson from the Python Cheese Shop at"
+    print "http://pypi.python.org/pypi/simplejson"
+    print
+    raise
+
 try:
     import feedparser
 except:
@@ -30,6 +49,532 @@ except:
     raise
 
 
+class BloomFilter(object):
+    """A fixed-size Bloom filter for strings.
+
+    Membership tests may return false positives (at roughly the configured
+    error rate once `capacity` items have been added) but never false
+    negatives. Memory usage is fixed at creation time.
+
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        """
+        Parameters:
+            capacity
+                The expected number of items.
+
+            error_rate (optional, default: 0.001)
+                The acceptable false positive rate at full capacity.
+
+        """
+        assert capacity > 0 and 0 < error_rate < 1
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, int(round(self.num_bits * math.log(2) / capacity)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, item):
+        # double hashing (Kirsch/Mitzenmacher) on a single MD5 digest
+        if isinstance(item, unicode):
+            item = item.encode("utf8")
+        h1, h2 = struct.unpack("<QQ", hashlib.md5(item).digest())
+        for i in xrange(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, item):
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item):
+        for pos in self._positions(item):
+            if not self.bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+
+class SeenURLIndex(object):
+    """Persistent index of the URLs which a monitor has already processed.
+
+    The index is backed by a plain log file with one URL per line (the log
+    file format of earlier versions of DeliciousMonitor). The log file is
+    read once when the index is loaded; afterwards, new URLs are added to
+    the in-memory index and appended to the log file.
+
+    By default, the in-memory index is an exact set of URLs. For very large
+    histories, a bounded-memory Bloom filter can be used instead. In Bloom
+    filter mode a snapshot of the filter is kept next to the log file
+    (`<log_filename>.bloom`), so that on startup only the part of the log
+    file written after the snapshot has to be read.
+
+    """
+
+    def __init__(self, log_filename, bloom_capacity=None, bloom_error_rate=0.001):
+        """
+        Parameters:
+            log_filename
+                The name of the log file.
+
+            bloom_capacity (optional, default: None)
+                If set, use a Bloom filter sized for this number of URLs
+                instead of an exact set. A small fraction of new URLs
+                (see bloom_error_rate) will then be mistaken for seen ones.
+
+            bloom_error_rate (optional, default: 0.001)
+                The false positive rate of the Bloom filter.
+
+        """
+        assert log_filename
+        self.log_filename = log_filename
+        self.bloom_capacity = bloom_capacity
+        self.bloom_error_rate = bloom_error_rate
+        self.snapshot_filename = log_filename + ".bloom"
+        self._urls = None
+        self._log_file = None
+        self._added = 0
+
+    def _new_index(self):
+        if self.bloom_capacity:
+            return BloomFilter(self.bloom_capacity, self.bloom_error_rate)
+        return set()
+
+    def _load_snapshot(self):
+        """Returns (filter, log offset) of the Bloom filter snapshot, or (None, 0)."""
+        try:
+            snapshot = open(self.snapshot_filename, "rb")
+        except IOError:
+            return None, 0
+        try:
+            try:
+                header = snapshot.readline().split()
+                offset, num_bits, num_hashes = [int(value) for value in header]
+                bloom = self._new_index()
+                if (bloom.num_bits, bloom.num_hashes) != (num_bits, num_hashes):
+                    # filter parameters have changed, rebuild from the log
+                    return None, 0
+                bits = snapshot.read()
+                if len(bits) != len(bloom.bits):
+                    return None, 0
+                bloom.bits = bytearray(bits)
+                return bloom, offset
+            except ValueError:
+                return None, 0
+        finally:
+            snapshot.close()
+
+    def load(self):
+        """Reads the log file into the in-memory index."""
+        index, offset = None, 0
+        if self.bloom_capacity:
+            index, offset = self._load_snapshot()
+        if index is None:
+            index, offset = self._new_index(), 0
+        if os.access(self.log_filename, os.F_OK):
+            log_file = open(self.log_filename, "r")
+            try:
+                log_file.seek(0, 2)
+                if offset > log_file.tell():
+                    # the log file was truncated or replaced, so the snapshot is stale
+                    index, offset = self._new_index(), 0
+                log_file.seek(offset)
+                for line in log_file:
+                    # remove leading and trailing whitespace if any (incl. newlines)
+                    url = line.strip()
+                    if url:
+                        index.add(url)
+            finally:
+                log_file.close()
+        self._urls = index
+        self._added = 0
+
+    @property
+    def loaded(self):
+        """Whether the log file has been read into memory."""
+        return self._urls is not None
+
+    def __contains__(self, url):
+        if self._urls is None:
+            self.load()
+        if isinstance(url, unicode):
+            url = url.encode("utf8")
+        return url in self._urls
+
+    def add(self, url):
+        """Marks url as seen and appends it to the log file."""
+        if self._urls is None:
+            self.load()
+        if self._log_file is None:
+            self._log_file = open(self.log_filename, "a")
+        if isinstance(url, unicode):
+            url = url.encode("utf8")
+        self._log_file.write("%s\n" % url)
+        self._urls.add(url)
+        self._added += 1
+
+    def flush(self):
+        """Flushes the log file and, in Bloom filter mode, writes a new snapshot."""
+        if self._log_file is not None:
+            self._log_file.flush()
+        if self.bloom_capacity and self._urls is not None and self._added:
+            offset = 0
+            if os.access(self.log_filename, os.F_OK):
+                offset = os.path.getsize(self.log_filename)
+            tmp_filename = self.snapshot_filename + ".tmp"
+            snapshot = open(tmp_filename, "wb")
+            try:
+                snapshot.write("%d %d %d\n" % (offset, self._urls.num_bits, self._urls.num_hashes))
+                snapshot.write(str(self._urls.bits))
+            finally:
+                snapshot.close()
+            os.rename(tmp_filename, self.snapshot_filename)
+            self._added = 0
+
+    def close(self):
+        """Flushes and closes the log file."""
+        self.flush()
+        if self._log_file is not None:
+            self._log_file.close()
+            self._log_file = None
+
+
+# characters which are not allowed in XML 1.0 documents, not even escaped
+_xml_illegal_chars = re.compile(u"[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+
+
+def _xml_escape(value):
+    """Returns value as a string which can be used in XML text and attribute values.
+
+    Non-ASCII characters are replaced by character references, so the result
+    is plain ASCII (see also DeliciousAPI._html_escape()).
+
+    """
+    if value is None:
+        return ""
+    if not isinstance(value, basestring):
+        value = unicode(value)
+    if isinstance(value, str):
+        value = value.decode("utf8", "replace")
+    value = _xml_illegal_chars.sub(u"", value)
+    return cgi.escape(value, True).encode("ascii", "xmlcharrefreplace")
+
+
+class FileSink(object):
+    """Abstract base class of output files for the metadata records of a DeliciousMonitor.
+
+    Records are buffered in memory and written in batches, i.e. once
+    batch_size records have been collected, once flush_seconds have passed
+    since the last write, or when flush() is called.
+
+    The output file can be rotated by size and/or age. A rotated segment is
+    renamed to <filename>.<YYYYmmdd-HHMMSS> and, optionally, compressed with
+    gzip (<filename>.<YYYYmmdd-HHMMSS>.gz).
+
+    FileSink itself cannot be instantiated; use one of its subclasses
+    XMLFileSink and JSONLinesFileSink, which implement format_record().
+
+    """
+
+    def __init__(self, filename, batch_size=100, flush_seconds=60, max_bytes=None, rotate_seconds=None, compress=False):
+        """
+        Parameters:
+            filename
+                The name of the output file.
+
+            batch_size (optional, default: 100)
+                The number of records which are buffered before they are written.
+
+            flush_seconds (optional, default: 60)
+                Maximum time in seconds for which records are buffered.
+
+            max_bytes (optional, default: None)
+                Rotate the output file once it has reached this size.
+
+            rotate_seconds (optional, default: None)
+                Rotate the output file once it is this many seconds old.
+
+            compress (optional, default: False)
+                Whether to gzip rotated segments.
+
+        """
+        if self.__class__.format_record == FileSink.format_record:
+            raise TypeError, "%s does not implement format_record(); use XMLFileSink or JSONLinesFileSink" % self.__class__.__name__
+        assert filename
+        assert batch_size >= 1
+        self.filename = filename
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_bytes = max_bytes
+        self.rotate_seconds = rotate_seconds
+        self.compress = compress
+        self._buffer = []
+        # callbacks of the buffered records, see write()
+        self._callbacks = []
+        self._last_flush = time.time()
+        self._file = None
+        self._size = 0
+        self._opened = None
+
+    def format_record(self, record):
+        """Returns a record as an (encoded) string.
+
+        A record is a dict with the keys "url", "users", "top_tags" (list of
+        (tag, count) tuples), "version" and "retrieved".
+
+        """
+        raise NotImplementedError
+
+    def write(self, url, document, version=1, callback=None):
+        """Adds the metadata of a URL (a DeliciousURL instance) to the output.
+
+        If given, callback is called without arguments once the record has
+        been written to the output file (see flush()).
+
+        """
+        record = {
+            "url": url,
+            "users": document.total_bookmarks,
+            "top_tags": document.top_tags,
+            "version": version,
+            "retrieved": datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+        }
+        self._buffer.append(self.format_record(record))
+        if callback is not None:
+            self._callbacks.append(callback)
+        if len(self._buffer) >= self.batch_size or time.time() - self._last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        """Writes all buffered records to the output file."""
+        self._last_flush = time.time()
+        if not self._buffer:
+            return
+        if self._file is None:
+            self._open()
+        data = "".join(self._buffer)
+        callbacks = self._callbacks
+        self._buffer = []
+        self._callbacks = []
+        self._file.write(data)
+        self._file.flush()
+        self._size += len(data)
+        for callback in callbacks:
+            callback()
+        if (self.max_bytes and self._size >= self.max_bytes) or \
+           (self.rotate_seconds and time.time() - self._opened >= self.rotate_seconds):
+            self.rotate()
+
+    def _open(self):
+        self._file = open(self.filename, "ab")
+        self._size = self._file.tell()
+        if self._opened is None:
+            if self._size:
+                self._opened = os.path.getmtime(self.filename)
+            else:
+                self._opened = time.time()
+
+    def rotate(self):
+        """Closes the current output file and moves it aside (see class documentation)."""
+        self.close()
+        if not os.access(self.filename, os.F_OK) or not os.path.getsize(self.filename):
+            return
+        segment = "%s.%s" % (self.filename, time.strftime("%Y%m%d-%H%M%S"))
+        counter = 1
+        while os.access(segment, os.F_OK) or os.access(segment + ".gz", os.F_OK):
+            segment = "%s.%s-%d" % (self.filename, time.strftime("%Y%m%d-%H%M%S"), counter)
+            counter += 1
+        os.rename(self.filename, segment)
+        self._opened = None
+        if self.compress:
+            source = open(segment, "rb")
+            try:
+                target = gzip.open(segment + ".gz", "wb")
+                try:
+                    shutil.copyfileobj(source, target)
+                finally:
+                    target.close()
+            finally:
+                source.close()
+            os.remove(segment)
+
+    def close(self):
+        """Flushes and closes the output file."""
+        if self._buffer:
+            # do not rotate from within close()
+            max_bytes, rotate_seconds = self.max_bytes, self.rotate_seconds
+            self.max_bytes = self.rotate_seconds = None
+            try:
+                self.flush()
+            finally:
+                self.max_bytes, self.rotate_seconds = max_bytes, rotate_seconds
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class XMLFileSink(FileSink):
+    """Writes records as <document> elements (the classic DeliciousMonitor output format)."""
+
+    def format_record(self, record):
+        lines = ['<document url="%s" users="%s" top_tags="%s" version="%s" retrieved="%s">\n' % (
+            _xml_escape(record["url"]), record["users"], len(record["top_tags"]), record["version"], record["retrieved"])]
+        for tag, count in record["top_tags"]:
+            lines.append('    <top_tag name="%s" count="%s" />\n' % (_xml_escape(tag), count))
+        lines.append('</document>\n')
+        return "".join(lines)
+
+
+class JSONLinesFileSink(FileSink):
+    """Writes records as JSON objects, one per line."""
+
+    def format_record(self, record):
+        return simplejson.dumps(record) + "\n"
+
+
+class RefreshQueue(object):
+    """Persistent schedule for re-retrieving the metadata of seen URLs.
+
+    Each URL is due again after its refresh interval. The interval is halved
+    whenever the number of bookmarks of a URL has grown since the previous
+    retrieval and doubled whenever it has not, within the given limits. So
+    young and fast-growing URLs are refreshed often, stale ones rarely.
+
+    The queue is kept in a file with one tab-separated line per URL (URL,
+    due time, interval, number of bookmarks, version), which is read once
+    and rewritten by save().
+
+    """
+
+    def __init__(self, filename, min_interval=3600, max_interval=30*86400):
+        """
+        Parameters:
+            filename
+                The name of the queue file.
+
+            min_interval (optional, default: 3600)
+                Minimum time between two retrievals of a URL in seconds.
+
+            max_interval (optional, default: 30 days)
+                Maximum time between two retrievals of a URL in seconds.
+
+        """
+        assert filename
+        assert 0 < min_interval <= max_interval
+        self.filename = filename
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        # maps URLs to [due time, URL, interval, total bookmarks, version]
+        self._entries = None
+        # heap of the entries which are not currently being refreshed
+        self._queue = []
+
+    def load(self):
+        """Reads the queue file."""
+        entries = {}
+        if os.access(self.filename, os.F_OK):
+            queue_file = open(self.filename, "r")
+            try:
+                for line in queue_file:
+                    fields = line.rstrip("\n").split("\t")
+                    if len(fields) != 5:
+                        continue
+                    try:
+                        url = fields[0].decode("utf8")
+                        entries[url] = [float(fields[1]), url, float(fields[2]), int(fields[3]), int(fields[4])]
+                    except ValueError:
+                        continue
+            finally:
+                queue_file.close()
+        self._entries = entries
+        self._queue = entries.values()
+        heapq.heapify(self._queue)
+
+    @property
+    def loaded(self):
+        """Whether the queue file has been read into memory."""
+        return self._entries is not None
+
+    def __len__(self):
+        if self._entries is None:
+            self.load()
+        return len(self._entries)
+
+    def add(self, url, total_bookmarks, now=None):
+        """Schedules a URL whose metadata has just been retrieved for the first time."""
+        if self._entries is None:
+            self.load()
+        if url in self._entries:
+            return
+        if now is None:
+            now = time.time()
+        entry = [now + self.min_interval, url, self.min_interval, total_bookmarks, 1]
+        self._entries[url] = entry
+        heapq.heappush(self._queue, entry)
+
+    def pop_due(self, limit, now=None):
+        """Returns up to limit URLs which are due, most overdue first.
+
+        Each returned URL must be passed to reschedule() once its metadata
+        has been retrieved (or has failed to be retrieved).
+
+        """
+        if self._entries is None:
+            self.load()
+        if now is None:
+            now = time.time()
+        urls = []
+        while self._queue and len(urls) < limit and self._queue[0][0] <= now:
+            urls.append(heapq.heappop(self._queue)[1])
+        return urls
+
+    def reschedule(self, url, total_bookmarks=None, now=None):
+        """Schedules a URL returned by pop_due() again.
+
+        Parameters:
+            url
+                The URL.
+
+            total_bookmarks (optional, default: None)
+                The current number of bookmarks of the URL, or None if its
+                metadata could not be retrieved. In the latter case, the
+                refresh interval is not changed.
+
+            now (optional, default: None)
+                The current time (default: time.time()).
+
+        Returns the version number of the URL's new record.
+
+        """
+        if now is None:
+            now = time.time()
+        entry = self._entries[url]
+        if total_bookmarks is not None:
+            if total_bookmarks > entry[3]:
+                entry[2] = max(self.min_interval, entry[2] / 2)
+            else:
+                entry[2] = min(self.max_interval, entry[2] * 2)
+            entry[3] = total_bookmarks
+            entry[4] += 1
+        entry[0] = now + entry[2]
+        heapq.heappush(self._queue, entry)
+        return entry[4]
+
+    def save(self):
+        """Writes the queue file."""
+        if self._entries is None:
+            return
+        tmp_filename = self.filename + ".tmp"
+        queue_file = open(tmp_filename, "w")
+        try:
+            for due, url, interval, total_bookmarks, version in self._entries.itervalues():
+                if isinstance(url, unicode):
+                    url = url.encode("utf8")
+                queue_file.write("%s\t%.0f\t%.0f\t%d\t%d\n" % (url, due, interval, total_bookmarks, version))
+        finally:
+            queue_file.close()
+        os.rename(tmp_filename, self.filename)
+
+
 class DeliciousMonitor(object):
     """Monitors a delicious.com bookmark RSS feed, retrieves metadata for each bookmark and stores it to file.
     
@@ -38,12 +583,15 @@ class DeliciousMonitor(object):
     some metadata for it from delicious.com (currently, common tags and number
     of bookmarks) and stores this information to file.
     
-    Note that URLs which have been processed in previous runs will NOT be
-    processed again, i.e. delicious.com metadata will NOT be updated.
+    The metadata of URLs which have been processed in previous runs is
+    retrieved again from time to time (see RefreshQueue), using a share of
+    the request budget. Every retrieval appends a new record for the URL to
+    the output file, with increasing version numbers, so that the output
+    file forms a time series for each URL.
     
     """
     
-    def __init__(self, rss_url="http://feeds.delicious.com/v2/rss", filename="delicious-monitor.xml", log_filename="delicious-monitor.log", interval=30, verbose=True):
+    def __init__(self, rss_url="http://feeds.delicious.com/v2/rss", filename="delicious-monitor.xml", log_filename="delicious-monitor.log", interval=30, verbose=True, bloom_capacity=None, max_workers=4, rate=1.0, max_retries=3, delicious=None, refresh_share=0.2, sink=None):
         """
         Parameters:
             rss_url (optional, default: "http://feeds.delicious.com/v2/rss")
@@ -60,18 +608,74 @@ class DeliciousMonitor(object):
             
             verbose (optional, default: True)
                 Whether to print non-critical processing information to STDOUT or not.
+
+            bloom_capacity (optional, default: None)
+                If set, keep track of seen URLs in a Bloom filter sized for
+                this number of URLs instead of an exact set (see SeenURLIndex).
+
+            max_workers (optional, default: 4)
+                Maximum number of URLs whose metadata is retrieved concurrently.
+
+            rate (optional, default: 1.0)
+                Maximum number of requests per second to delicious.com, shared
+                by all workers.
+
+            max_retries (optional, default: 3)
+                How often the metadata of a URL is retrieved again in later
+                runs after a failure, before the URL is given up. Failed URLs
+                are kept in a retry file (<log_filename>.retry).
+
+            delicious (optional, default: None)
+                The DeliciousAPI instance to use. Monitors which share a
+                DeliciousAPI instance with a rate_limiter also share its
+                request budget (see DeliciousMonitorScheduler). If None, a new
+                DeliciousAPI instance is created.
+
+            refresh_share (optional, default: 0.2)
+                The share of the request budget of a run (rate requests per
+                second over interval minutes) which may be used to retrieve
+                the metadata of seen URLs again. If the DeliciousAPI instance
+                has a rate_limiter, the budget is based on its rate instead,
+                split evenly between the monitors of a
+                DeliciousMonitorScheduler. Refreshed URLs are kept in a queue
+                file (<log_filename>.refresh). Set to 0 to disable refreshes.
+
+            sink (optional, default: None)
+                The FileSink to which metadata is written, i.e. an
+                XMLFileSink or a JSONLinesFileSink, e.g. with rotation
+                (max_bytes, rotate_seconds). If None, an XMLFileSink for
+                filename is used.
+
+        The ETag and Last-Modified headers of the RSS feed and a hash of its
+        entries are kept in a state file (<log_filename>.feed), so that
+        unchanged feeds are neither downloaded nor processed again.
                 
         """
         self.rss_url = rss_url
-        self._delicious = deliciousapi.DeliciousAPI()
+        self._delicious = delicious or deliciousapi.DeliciousAPI()
         self.filename = filename
         self.log_filename = log_filename
         self.interval = interval
         self.verbose = verbose
-        self.urls = []
         # ensure that the name of the output file and log file is not None etc.
         assert self.filename
         assert self.log_filename
+        self.seen_urls = SeenURLIndex(self.log_filename, bloom_capacity=bloom_capacity)
+        self.max_workers = max_workers
+        self.rate = rate
+        self.max_retries = max_retries
+        self.retry_filename = self.log_filename + ".retry"
+        # maps URLs which failed in previous runs to their number of failures
+        self.retries = None
+        self.feed_state_filename = self.log_filename + ".feed"
+        # "etag", "modified" and "entries_hash" of the last processed feed
+        self.feed_state = None
+        self.refresh_share = refresh_share
+        # the share of a shared rate limiter's budget that this monitor
+        # may use; set by DeliciousMonitorScheduler
+        self.budget_share = 1.0
+        self.refresh_queue = RefreshQueue(self.log_filename + ".refresh")
+        self.sink = sink or XMLFileSink(self.filename)
         
     def run(self):
         """Start the monitor."""
@@ -103,91 +707,340 @@ class DeliciousMonitor(object):
             time.sleep(wait_seconds)
         
     def monitor(self):
-        """Monitors an RSS feed."""
+        """Monitors an RSS feed.
+        
+        Returns the number of new entries found in the RSS feed.
+        
+        """
+        
+        if self.retries is None:
+            self.retries = self._load_retries()
         
         # download and parse RSS feed
-        f = feedparser.parse(self.rss_url)
+        entries, new_feed_state = self._poll_feed()
         
-        output_file = codecs.open(self.filename, "a", "utf8")
-        log_file = None
+        # seen URLs whose metadata is due to be refreshed
+        refresh_urls = self.refresh_queue.pop_due(self._refresh_limit())
         
-        if os.access(self.log_filename, os.F_OK):
+        if entries is None:
             if self.verbose:
-                print "[MONITOR] Log file found. Trying to resume...",
+                print "[MONITOR] Feed has not changed"
+            if not self.retries and not refresh_urls:
+                return 0
+            entries = []
+        
+        if not self.seen_urls.loaded:
+            # the log file is read only once, on the first run
+            if self.verbose:
+                print "[MONITOR] Loading log file...",
             try:
-                # read in previous log data for resuming
-                log_file = open(self.log_filename, 'r')
-                # remove leading and trailing whitespace if any (incl. newlines)
-                self.urls = [line.strip() for line in log_file.readlines()]
-                log_file.close()
+                self.seen_urls.load()
                 if self.verbose:
                     print "done"
             except IOError:
-                # most probably, the log file does not exist (yet)
                 if self.verbose:
                     print "failed"
-        else:
-            # log file does not exist, so there isn't any resume data
-            # to read in
-            pass
-
-        try:
-            # now open it for writing (i.e., appending) and logging
-            if self.verbose:
-                print "[MONITOR] Open log file for appending...",
-            log_file = open(self.log_filename, 'a')
-            if self.verbose:
-                print "done"
-        except IOError:
-            if self.verbose:
-                print "failed"
-            print "[MONITOR] ERROR: could not open log file for appending"
-            self._cleanup()
-            return
+                print "[MONITOR] ERROR: could not read log file"
+                for url in refresh_urls:
+                    self.refresh_queue.reschedule(url)
+                return 0
         
-        # get only new entries
+        # get only new entries (feeds may list the same URL more than once)
         new_entries = []
-        for entry in f.entries:
-            new_entries = [entry for entry in f.entries if entry.link not in self.urls]
+        new_urls = set()
+        for entry in entries:
+            if entry.link not in new_urls and entry.link not in self.seen_urls:
+                new_urls.add(entry.link)
+                new_entries.append(entry)
         
         if self.verbose:
-            print "[MONITOR] Found %s new entries" % len(new_entries)
+            print "[MONITOR] Found %s new entries, %s entries to retry, %s entries to refresh" % (len(new_entries), len(self.retries), len(refresh_urls))
         
-        # query metadata about each entry from delicious.com
-        for index, entry in enumerate(new_entries):
-            url = entry.link
-            
-            if self.verbose:
-                print "[MONITOR] Processing entry #%s: '%s'" % (index + 1, url),
-            try:
-                time.sleep(1) # be nice and wait 1 sec between connects to delicious.com
-                document = self._delicious.get_url(url)
-            except (deliciousapi.DeliciousError,), error_string:
+        # URLs which failed in previous runs are retried first
+        urls = [url for url in self.retries if url not in new_urls]
+        urls.extend(entry.link for entry in new_entries)
+        urls.extend(refresh_urls)
+        refreshing = set(refresh_urls)
+        
+        # query metadata about each entry from delicious.com; the workers
+        # share one rate limit, so this is still nice to delicious.com
+        try:
+            results = self._delicious.get_urls_info(urls, max_workers=self.max_workers, rate=self.rate)
+            for index, (url, document, error) in enumerate(results):
+                if url in refreshing:
+                    refreshing.discard(url)
+                    if error is not None:
+                        print "[MONITOR] ERROR: could not refresh '%s': %s" % (url, error)
+                        self.refresh_queue.reschedule(url)
+                        continue
+                    version = self.refresh_queue.reschedule(url, document.total_bookmarks)
+                    if self.verbose:
+                        print "[MONITOR] Refreshed entry #%s: '%s'" % (index + 1, url)
+                    self.sink.write(url, document, version)
+                    continue
+                
+                if error is not None:
+                    failures = self.retries.get(url, 0) + 1
+                    if failures > self.max_retries:
+                        print "[MONITOR] ERROR: giving up on '%s': %s" % (url, error)
+                        del self.retries[url]
+                        # do not try again in later runs
+                        self.seen_urls.add(url)
+                    else:
+                        print "[MONITOR] ERROR: could not process '%s' (attempt %s): %s" % (url, failures, error)
+                        self.retries[url] = failures
+                    continue
+                
                 if self.verbose:
-                    print "failed"
-                print "[MONITOR] ERROR: %s" % error_string
-                # clean up
-                output_file.close()
-                log_file.close()
-                return
+                    print "[MONITOR] Processed entry #%s: '%s'" % (index + 1, url)
+                
+                # update log file, but only once the record of the URL is in
+                # the output file, so that the URL cannot be marked as seen
+                # without its record if the monitor is killed
+                self.sink.write(url, document, 1, callback=functools.partial(self.seen_urls.add, url))
+                self.retries.pop(url, None)
+                if self.refresh_share > 0:
+                    self.refresh_queue.add(url, document.total_bookmarks)
+            # all entries of this feed version have been handled now
+            if new_feed_state is not None:
+                self.feed_state = new_feed_state
+                self._save_feed_state()
+        finally:
+            # URLs whose refresh did not finish are due again next run
+            for url in refreshing:
+                self.refresh_queue.reschedule(url)
+            # clean up; write the output before marking URLs as seen
+            self.sink.flush()
+            self.seen_urls.flush()
+            self._save_retries()
+            self.refresh_queue.save()
+        return len(new_entries)
+    
+    def _refresh_limit(self):
+        """Returns the maximum number of URLs to refresh in one run."""
+        if self.refresh_share <= 0:
+            return 0
+        rate = self.rate
+        if self._delicious.rate_limiter is not None:
+            # the actual request budget, which may be shared with other
+            # monitors
+            rate = self._delicious.rate_limiter.rate * self.budget_share
+        # a metadata lookup takes two requests (URL info and bookmarks)
+        return int(self.refresh_share * rate * 60 * self.interval / 2)
+    
+    def _poll_feed(self):
+        """Downloads and parses the RSS feed unless it has not changed since the last run.
+
+        Returns a tuple of (entries, feed state). entries is None if the
+        feed has not changed, i.e. if the server answered a conditional
+        request with "304 Not Modified" or if the entries are the same as
+        in the last run.
+        
+        """
+        if self.feed_state is None:
+            self.feed_state = self._load_feed_state()
+        if self._delicious.rate_limiter is not None:
+            # feed requests count against the shared request budget, too
+            self._delicious.rate_limiter.acquire(urlparse.urlsplit(self.rss_url)[1])
+        f = feedparser.parse(self.rss_url, etag=self.feed_state.get("etag"), modified=self.feed_state.get("modified"))
+        if f.get("status") == 304:
+            return None, None
+        # hash the entry URLs, which is all that the monitor looks at
+        links = sorted(set(entry.get("link", u"") for entry in f.entries))
+        entries_hash = hashlib.md5(u"\n".join(links).encode("utf8")).hexdigest()
+        feed_state = {}
+        if f.get("etag"):
+            feed_state["etag"] = f.etag
+        if f.get("modified"):
+            feed_state["modified"] = f.modified
+        if links:
+            feed_state["entries_hash"] = entries_hash
+        if links and entries_hash == self.feed_state.get("entries_hash"):
+            # the server does not support conditional requests (or the feed
+            # was regenerated), but its entries are the same
+            if feed_state != self.feed_state:
+                self.feed_state = feed_state
+                self._save_feed_state()
+            return None, None
+        return f.entries, feed_state
+    
+    def _load_feed_state(self):
+        """Returns the feed state from the feed state file as a dict."""
+        feed_state = {}
+        if not os.access(self.feed_state_filename, os.F_OK):
+            return feed_state
+        state_file = open(self.feed_state_filename, "r")
+        try:
+            for line in state_file:
+                fields = line.rstrip("\n").split("\t", 1)
+                if len(fields) == 2 and fields[1]:
+                    feed_state[fields[0]] = fields[1]
+        finally:
+            state_file.close()
+        return feed_state
+    
+    def _save_feed_state(self):
+        """Writes the feed state to the feed state file."""
+        tmp_filename = self.feed_state_filename + ".tmp"
+        state_file = open(tmp_filename, "w")
+        try:
+            for key in sorted(self.feed_state):
+                value = self.feed_state[key]
+                if isinstance(value, unicode):
+                    value = value.encode("utf8")
+                state_file.write("%s\t%s\n" % (key, value))
+        finally:
+            state_file.close()
+        os.rename(tmp_filename, self.feed_state_filename)
+    
+    def _load_retries(self):
+        """Returns the retry queue from the retry file as a dict of URL -> number of failures."""
+        retries = {}
+        if not os.access(self.retry_filename, os.F_OK):
+            return retries
+        retry_file = open(self.retry_filename, "r")
+        try:
+            for line in retry_file:
+                fields = line.rstrip("\n").rsplit("\t", 1)
+                if len(fields) == 2 and fields[1].isdigit():
+                    retries[fields[0].decode("utf8")] = int(fields[1])
+        finally:
+            retry_file.close()
+        return retries
+    
+    def _save_retries(self):
+        """Writes the retry queue to the retry file."""
+        if self.retries is None:
+            return
+        if not self.retries and not os.access(self.retry_filename, os.F_OK):
+            return
+        tmp_filename = self.retry_filename + ".tmp"
+        retry_file = open(tmp_filename, "w")
+        try:
+            for url, failures in self.retries.iteritems():
+                if isinstance(url, unicode):
+                    url = url.encode("utf8")
+                retry_file.write("%s\t%d\n" % (url, failures))
+        finally:
+            retry_file.close()
+        os.rename(tmp_filename, self.retry_filename)
+        
+        
+class DeliciousMonitorScheduler(object):
+    """Runs many DeliciousMonitors in a single process.
+    
+    The monitors are kept in a priority queue ordered by the time of their
+    next run. After each run, the interval of a monitor is adapted to the
+    number of new entries found in its RSS feed: monitors of quiet feeds
+    back off, monitors of busy feeds run more often. All monitors share one
+    DeliciousAPI instance and thus one request budget; each monitor's
+    refreshes of seen URLs get an equal part of it (see refresh_share).
+    
+    """
+    
+    def __init__(self, rate=1.0, min_interval=5, max_interval=240, target_new_entries=5, verbose=True):
+        """
+        Parameters:
+            rate (optional, default: 1.0)
+                Maximum number of requests per second to delicious.com for
+                all monitors together.
             
-            if self.verbose:
-                print "done"
+            min_interval (optional, default: 5)
+                Minimum time between two runs of a monitor in minutes.
             
-            # update log file
-            log_file.write("%s\n" % url)
-            # update output file
-            output_file.write('<document url="%s" users="%s" top_tags="%s">\n' % (url, document.total_bookmarks, len(document.top_tags)))
-            for tag, count in document.top_tags:
-                output_file.write('    <top_tag name="%s" count="%s" />\n' % (tag, count))
-            output_file.write('</document>\n')
-            output_file.flush()
+            max_interval (optional, default: 240)
+                Maximum time between two runs of a monitor in minutes.
+            
+            target_new_entries (optional, default: 5)
+                The number of new entries per run at which a feed is polled
+                at the right pace. Feeds with fewer new entries per run are
+                polled less often, feeds with more new entries more often.
+                This should be well below the number of entries of a feed, so
+                that busy feeds do not lose entries between runs.
+            
+            verbose (optional, default: True)
+                Whether to print non-critical processing information to STDOUT or not.
+                
+        """
+        assert 0 < min_interval <= max_interval
+        assert target_new_entries > 0
+        self.delicious = deliciousapi.DeliciousAPI(rate_limiter=deliciousapi.DeliciousRateLimiter(rate))
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.target_new_entries = target_new_entries
+        self.verbose = verbose
+        self.monitors = []
+        # heap of (next run time, sequence number, monitor)
+        self._queue = []
+        self._sequence = 0
+    
+    def add_feed(self, rss_url, filename, log_filename, interval=30, **kwargs):
+        """Creates a DeliciousMonitor for an RSS feed and schedules it.
+        
+        The parameters are those of DeliciousMonitor. Returns the new monitor.
         
-        # clean up
-        output_file.close()
-        log_file.close()
+        """
+        kwargs.setdefault("verbose", self.verbose)
+        monitor = DeliciousMonitor(rss_url=rss_url, filename=filename, log_filename=log_filename, interval=interval, delicious=self.delicious, **kwargs)
+        self.add_monitor(monitor)
+        return monitor
+    
+    def add_monitor(self, monitor, next_run_time=None):
+        """Schedules a DeliciousMonitor, by default for immediate execution."""
+        if monitor not in self.monitors:
+            self.monitors.append(monitor)
+            # split the refresh budget evenly between the monitors
+            for scheduled in self.monitors:
+                scheduled.budget_share = 1.0 / len(self.monitors)
+        if next_run_time is None:
+            next_run_time = time.time()
+        heapq.heappush(self._queue, (next_run_time, self._sequence, monitor))
+        self._sequence += 1
+    
+    def adapt_interval(self, monitor, new_entries):
+        """Returns the next interval of a monitor whose last run found new_entries entries."""
+        interval = monitor.interval
+        if new_entries == 0:
+            # quiet feed, back off
+            interval *= 1.5
+        else:
+            # move halfway towards the interval at which a run would find
+            # target_new_entries entries at the observed entry rate
+            interval = 0.5 * interval + 0.5 * interval * self.target_new_entries / float(new_entries)
+        return max(self.min_interval, min(self.max_interval, interval))
+    
+    def run_pending(self):
+        """Runs all monitors which are due.
         
+        Returns the number of seconds until the next monitor is due.
         
+        """
+        while self._queue and self._queue[0][0] <= time.time():
+            next_run_time, sequence, monitor = heapq.heappop(self._queue)
+            if self.verbose:
+                print "[SCHEDULER] Running monitor of %s" % monitor.rss_url
+            try:
+                new_entries = monitor.monitor()
+            except Exception, e:
+                # a broken feed must not stop the other monitors
+                print "[SCHEDULER] ERROR: monitor of %s failed: %s" % (monitor.rss_url, e)
+                new_entries = 0
+            monitor.interval = self.adapt_interval(monitor, new_entries or 0)
+            if self.verbose:
+                print "[SCHEDULER] Next run of monitor of %s in %.1f minutes" % (monitor.rss_url, monitor.interval)
+            self.add_monitor(monitor, time.time() + 60 * monitor.interval)
+        if not self._queue:
+            return None
+        return max(0, self._queue[0][0] - time.time())
+    
+    def run(self):
+        """Start the scheduler."""
+        while self._queue:
+            wait_seconds = self.run_pending()
+            if wait_seconds:
+                time.sleep(wait_seconds)
+
+
 if __name__ == "__main__":
     monitor = DeliciousMonitor(interval=30)
     monitor.run()